@@ -0,0 +1,73 @@
+"""
+Per-request cost of the debug dumps of the request, response and stream.
+
+Sends the large payload from bench_models through the test client with the
+flask_ask logger at WARN and at DEBUG, and with the original dbgdump, which
+serialized unconditionally, reproduced as the baseline. It also counts the
+JSON serializations performed, which should be only the response itself
+when debug logging is off. At DEBUG the logger has only a NullHandler, so the
+dumps are never formatted there either.
+
+    python -m benchmarks.bench_debug
+"""
+import json
+import logging
+import timeit
+
+from flask import Flask
+from mock import patch
+
+from flask_ask import Ask, statement, logger, core
+
+from .bench_models import make_payload
+
+
+def eager_dbgdump(obj, default=None, cls=None, event=None):
+    """The original dbgdump, which serialized before checking the log level."""
+    indent = 2 if core.current_app.config.get('ASK_PRETTY_DEBUG_LOGS', False) else None
+    msg = core.json_backend().dumps(obj, indent=indent, default=default, cls=cls)
+    logger.debug(msg)
+
+
+def main(number=2000):
+    app = Flask(__name__)
+    app.config['ASK_VERIFY_REQUESTS'] = False
+    ask = Ask(app, '/ask')
+
+    @ask.intent('BenchIntent')
+    def bench():
+        return statement('ok')
+
+    client = app.test_client()
+    body = json.dumps(make_payload())
+    calls = []
+
+    def post():
+        response = client.post('/ask', data=body)
+        assert response.status_code == 200, response.status_code
+
+    def counting_dumps(obj, **kwargs):
+        calls.append(None)
+        return json.dumps(obj, **kwargs)
+
+    logger.handlers, logger.propagate = [logging.NullHandler()], False
+    modes = (('original, WARN', logging.WARN, eager_dbgdump),
+             ('WARN', logging.WARN, core.dbgdump),
+             ('DEBUG', logging.DEBUG, core.dbgdump))
+    for name, level, dbgdump in modes:
+        logger.setLevel(level)
+        with patch('flask_ask.core.get_backend') as get_backend, \
+                patch('flask_ask.core.dbgdump', dbgdump), patch('flask_ask.models.dbgdump', dbgdump):
+            get_backend.return_value.loads = json.loads
+            get_backend.return_value.dumps = counting_dumps
+            post()
+            del calls[:]
+            post()
+            per_request = len(calls)
+            seconds = timeit.timeit(post, number=number)
+        print('{:<16} {:>7.1f} us/request  {} serializations/request'.format(
+            name, seconds / number * 1e6, per_request))
+
+
+if __name__ == '__main__':
+    main()
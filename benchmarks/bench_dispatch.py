@@ -0,0 +1,94 @@
+"""
+Overhead of binding request parameters to an intent's view function.
+
+Measures Ask._map_intent_to_view_func for intents taking zero, three and six
+slot parameters with mappings, converters and defaults. The original
+dispatch, which inspected the view's signature and resolved converter
+shorthands on every request, is reproduced here as the baseline.
+
+    python -m benchmarks.bench_dispatch
+"""
+import inspect
+import timeit
+from functools import partial
+
+from flask import Flask
+
+from flask_ask import Ask, models
+from flask_ask.core import _converters
+
+
+def original_dispatch(ask, intent, view_func, mapping, convert, default):
+    """The original _map_intent_to_view_func and _map_params_to_view_args."""
+    arg_names = inspect.getfullargspec(view_func).args
+    request_data = {}
+    if intent.slots is not None:
+        for slot_key in intent.slots.keys():
+            slot_object = getattr(intent.slots, slot_key)
+            request_data[slot_object.name] = ask._get_slot_value(slot_object=slot_object)
+    arg_values = []
+    convert_errors = {}
+    for arg_name in arg_names:
+        param_or_slot = mapping.get(arg_name, arg_name)
+        arg_value = request_data.get(param_or_slot)
+        if arg_value is None or arg_value == "":
+            if arg_name in default:
+                default_value = default[arg_name]
+                if callable(default_value):
+                    default_value = default_value()
+                arg_value = default_value
+        elif arg_name in convert:
+            shorthand_or_function = convert[arg_name]
+            if shorthand_or_function in _converters:
+                convert_func = _converters[shorthand_or_function]
+            else:
+                convert_func = shorthand_or_function
+            try:
+                arg_value = convert_func(arg_value)
+            except Exception as e:
+                convert_errors[arg_name] = e
+        arg_values.append(arg_value)
+    ask.convert_errors = convert_errors
+    return partial(view_func, *arg_values)
+
+
+def register(ask):
+    views = {}
+
+    def add(name, f, mapping={}, convert={}, default={}):
+        ask.intent(name, mapping=mapping, convert=convert, default=default)(f)
+        views[name] = (f, mapping, convert, default)
+
+    add('NoSlots', lambda: None)
+    add('ThreeSlots', lambda city, day, count: None,
+        mapping={'city': 'City', 'day': 'Day', 'count': 'Count'},
+        convert={'day': 'date', 'count': int}, default={'count': 1})
+    add('SixSlots', lambda city, day, count, first, last, when: None,
+        mapping={'city': 'City', 'day': 'Day', 'count': 'Count', 'first': 'FirstName', 'last': 'LastName'},
+        convert={'day': 'date', 'count': int, 'when': 'time'}, default={'count': 1, 'last': lambda: 'Smith'})
+    return views
+
+
+def make_intent(name):
+    values = {'City': 'Paris', 'Day': '2017-07-08', 'Count': '3', 'FirstName': 'Ada', 'LastName': '', 'when': '10:30'}
+    slots = {} if name == 'NoSlots' else {k: {'name': k, 'value': v} for k, v in values.items()}
+    return models._Field({'type': 'IntentRequest', 'intent': {'name': name, 'slots': slots}})
+
+
+def main(number=20000):
+    app = Flask(__name__)
+    ask = Ask(app, '/ask')
+    views = register(ask)
+    with app.app_context():
+        for name, (view_func, mapping, convert, default) in sorted(views.items()):
+            ask.request = make_intent(name)
+            intent = ask.request.intent
+            before = timeit.timeit(lambda: original_dispatch(ask, intent, view_func, mapping, convert, default),
+                                   number=number)
+            after = timeit.timeit(lambda: ask._map_intent_to_view_func(intent), number=number)
+            print('{:<12} original {:6.2f} us  binder {:6.2f} us'.format(
+                name, before / number * 1e6, after / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
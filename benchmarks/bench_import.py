@@ -0,0 +1,56 @@
+"""
+Cold-start cost of importing flask_ask, from python -X importtime output.
+
+Imports flask and flask_ask in fresh interpreters and reports the median
+cumulative import time of each, the time flask_ask adds on top of flask,
+the slowest modules it pulls in and which optional dependencies are loaded
+by the import alone.
+
+    python -m benchmarks.bench_import
+"""
+import subprocess
+import sys
+
+OPTIONAL = ('yaml', 'aniso8601', 'OpenSSL', 'cryptography', 'werkzeug.contrib.cache', 'sqlite3', 'jinja2')
+
+
+def importtime(module):
+    """Runs python -X importtime -c 'import module' and returns {name: (self_us, cumulative_us)}."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            stderr=subprocess.PIPE, check=True).stderr.decode('utf-8')
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(runs=15):
+    importtime('flask_ask')  # compile bytecode outside the measurement
+    flask_runs = [importtime('flask') for _ in range(runs)]
+    ask_runs = [importtime('flask_ask') for _ in range(runs)]
+    flask_us = median(r['flask'][1] for r in flask_runs)
+    ask_us = median(r['flask_ask'][1] for r in ask_runs)
+    print('import flask       {:8.1f} ms'.format(flask_us / 1000.0))
+    print('import flask_ask   {:8.1f} ms  ({:+.1f} ms over flask)'.format(ask_us / 1000.0, (ask_us - flask_us) / 1000.0))
+
+    flask_modules = set(flask_runs[0])
+    extra = [(median(r[name][0] for r in ask_runs if name in r), name)
+             for name in ask_runs[0] if name not in flask_modules]
+    print('\nslowest modules imported by flask_ask but not by flask (self time):')
+    for self_us, name in sorted(extra, reverse=True)[:10]:
+        print('  {:8.2f} ms  {}'.format(self_us / 1000.0, name))
+
+    loaded = [name for name in OPTIONAL if name in ask_runs[0]]
+    print('\noptional dependencies loaded at import: {}'.format(', '.join(loaded) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
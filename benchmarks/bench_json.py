@@ -0,0 +1,61 @@
+"""
+Throughput of each ASK_JSON_BACKEND when rendering responses and parsing requests.
+
+Renders a speech response, a card response, a dialog directive and an audio
+play directive inside an app context, and parses the large request payload
+from bench_models. Backends that are not installed are skipped.
+
+    python -m benchmarks.bench_json
+"""
+import json
+import timeit
+
+from flask import Flask
+
+from flask_ask import Ask, statement, question, elicit_slot, audio, json_backends, models
+
+from .bench_models import make_payload
+
+
+def responses():
+    return {
+        'speech': lambda: statement('Hello there, how are you doing today?'),
+        'card': lambda: question('Which city?').reprompt('Which city would you like?')
+                                               .standard_card('Weather', 'Sunny and 25 degrees',
+                                                              'https://example.com/small.png',
+                                                              'https://example.com/large.png'),
+        'directive': lambda: elicit_slot('City', 'Which city?'),
+        'audio': lambda: audio('Playing').play('https://example.com/stream.mp3', offset=0),
+    }
+
+
+def main(number=5000):
+    app = Flask(__name__)
+    app.config['ASK_VERIFY_REQUESTS'] = False
+    ask = Ask(app, '/ask')
+    payload = make_payload()
+    raw = json.dumps(payload).encode('utf-8')
+
+    for name in ('flask', 'json', 'ujson', 'orjson'):
+        try:
+            json_backends._backend_classes[name]()
+        except ImportError:
+            print('{:<8} not installed'.format(name))
+            continue
+        app.config['ASK_JSON_BACKEND'] = name
+        backend = json_backends.get_backend(name)
+        with app.test_request_context('/ask', method='POST', data=raw):
+            ask.context = models._Field(payload['context'])
+            ask.session = models._Field(payload['session'])
+            timings = []
+            for kind, build in sorted(responses().items()):
+                response = build()
+                seconds = timeit.timeit(response.render_response, number=number)
+                timings.append('{} {:6.1f} us'.format(kind, seconds / number * 1e6))
+            seconds = timeit.timeit(lambda: backend.loads(raw), number=number)
+            timings.append('request loads {:6.1f} us'.format(seconds / number * 1e6))
+        print('{:<8} {}'.format(name, '  '.join(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Per-invocation latency of Ask.run_aws_lambda through WSGI and with direct=True.
+
+Invokes a skill the way the AWS Lambda handler does, with an IntentRequest
+whose view plays an audio stream and with a SessionEndedRequest. The WSGI
+path serializes the event, copies the cached WSGI environ and parses the
+JSON output; "wsgi-cold" rebuilds the environ from os.environ on every
+invocation, as run_aws_lambda originally did. The direct path dispatches
+the event dict under an app context.
+
+    python -m benchmarks.bench_lambda
+"""
+import copy
+import timeit
+
+from flask import Flask
+
+from flask_ask import Ask, audio
+
+
+def make_event(request):
+    user = {'userId': 'amzn1.ask.account.AM3B00000000000000000000000'}
+    application = {'applicationId': 'amzn1.ask.skill.00000000-0000-0000-0000-000000000000'}
+    return {
+        'version': '1.0',
+        'session': {'new': False, 'sessionId': 'amzn1.echo-api.session.0000', 'application': application,
+                    'attributes': {'episode': 12}, 'user': user},
+        'context': {'System': {'application': application, 'user': user,
+                               'device': {'supportedInterfaces': {'AudioPlayer': {}}}},
+                    'AudioPlayer': {'offsetInMilliseconds': 0, 'playerActivity': 'IDLE'}},
+        'request': dict(request, requestId='amzn1.echo-api.request.0000', timestamp='2017-07-08T10:30:00Z',
+                        locale='en-US'),
+    }
+
+
+EVENTS = {
+    'IntentRequest': make_event({'type': 'IntentRequest',
+                                 'intent': {'name': 'PlayIntent', 'slots': {'Episode': {'name': 'Episode',
+                                                                                        'value': '12'}}}}),
+    'SessionEndedRequest': make_event({'type': 'SessionEndedRequest', 'reason': 'USER_INITIATED'}),
+}
+
+
+def main(number=2000):
+    app = Flask(__name__)
+    ask = Ask(app, '/')
+
+    @ask.intent('PlayIntent', mapping={'episode': 'Episode'}, convert={'episode': int})
+    def play(episode):
+        return audio('Playing episode {}'.format(episode)).play(
+            'https://example.com/episode-{:04d}.mp3'.format(episode))
+
+    for name, event in sorted(EVENTS.items()):
+        # the Lambda runtime hands each invocation a freshly parsed event
+        events = [copy.deepcopy(event) for _ in range(number)]
+        for path in ('wsgi-cold', 'wsgi', 'direct'):
+            it = iter(events)
+
+            def invoke():
+                if path == 'wsgi-cold':
+                    ask._lambda_environ_template = None
+                return ask.run_aws_lambda(next(it), direct=path == 'direct')
+
+            seconds = timeit.timeit(invoke, number=number)
+            print('{:<20} {:<9} {:7.1f} us/invocation'.format(name, path, seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
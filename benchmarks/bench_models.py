@@ -0,0 +1,139 @@
+"""
+Cost of wrapping a request payload in _Field, and of reading from it.
+
+Builds a large, realistic payload (Display, Viewport and APL context, entity
+resolution on every slot) and measures the time and memory allocated to wrap
+it and read what a typical handler reads: the intent slots and the session
+attributes. It then measures attribute access throughput on the request,
+session and context objects. The original _Field, which converted eagerly
+and re-parsed timestamps on every access, is reproduced here as the baseline,
+and the slotted models used with ASK_TYPED_MODELS are measured alongside.
+
+    python -m benchmarks.bench_models
+"""
+import timeit
+import tracemalloc
+
+import aniso8601
+
+from flask_ask.models import _Field, RequestBody
+
+
+class _EagerField(dict):
+    """The original _Field, which converted every nested dict up front."""
+
+    def __init__(self, request_json={}):
+        super(_EagerField, self).__init__(request_json)
+        for key, value in request_json.items():
+            if isinstance(value, dict):
+                value = _EagerField(value)
+            self[key] = value
+
+    def __getattr__(self, attr):
+        if 'timestamp' in attr:
+            return aniso8601.parse_datetime(self.get(attr))
+        return self.get(attr)
+
+
+def make_payload(slot_count=10):
+    slots = {}
+    for i in range(slot_count):
+        name = 'Slot{}'.format(i)
+        slots[name] = {
+            'name': name, 'value': 'value {}'.format(i), 'confirmationStatus': 'NONE', 'source': 'USER',
+            'resolutions': {'resolutionsPerAuthority': [{
+                'authority': 'amzn1.er-authority.echo-sdk.skill.{}'.format(name),
+                'status': {'code': 'ER_SUCCESS_MATCH'},
+                'values': [{'value': {'name': 'value {}'.format(i), 'id': str(i)}}]}]},
+        }
+    viewport = {
+        'experiences': [{'arcMinuteWidth': 246, 'arcMinuteHeight': 144, 'canRotate': False, 'canResize': False}],
+        'shape': 'RECTANGLE', 'pixelWidth': 1024, 'pixelHeight': 600, 'dpi': 160,
+        'currentPixelWidth': 1024, 'currentPixelHeight': 600,
+        'touch': ['SINGLE'], 'keyboard': ['DIRECTION'],
+        'video': {'codecs': ['H_264_42', 'H_264_41']},
+    }
+    return {
+        'version': '1.0',
+        'session': {
+            'new': False, 'sessionId': 'amzn1.echo-api.session.0000',
+            'application': {'applicationId': 'amzn1.ask.skill.0000'},
+            'attributes': {'history': [{'intent': 'Intent{}'.format(i)} for i in range(20)], 'color': 'blue'},
+            'user': {'userId': 'amzn1.ask.account.0000', 'permissions': {'consentToken': 'x' * 800}},
+        },
+        'context': {
+            'System': {
+                'application': {'applicationId': 'amzn1.ask.skill.0000'},
+                'user': {'userId': 'amzn1.ask.account.0000', 'permissions': {'consentToken': 'x' * 800}},
+                'device': {'deviceId': 'amzn1.ask.device.0000', 'supportedInterfaces': {
+                    'AudioPlayer': {}, 'Display': {'templateVersion': '1.0', 'markupVersion': '1.0'},
+                    'Alexa.Presentation.APL': {'runtime': {'maxVersion': '1.1'}}}},
+                'apiEndpoint': 'https://api.amazonalexa.com', 'apiAccessToken': 'y' * 800,
+            },
+            'Display': {'token': 'display-token'},
+            'Viewport': viewport,
+            'Viewports': [dict(viewport, type='APL', id='main')],
+            'Alexa.Presentation.APL': {'token': 'apl-token', 'version': 'AriaRuntimeLibrary-1.1',
+                                       'componentsVisibleOnScreen': [{'uid': ':1000', 'children': [
+                                           {'uid': ':{}'.format(1001 + i), 'type': 'text',
+                                            'position': '1024x600+0+0:0', 'entities': []} for i in range(20)]}]},
+            'AudioPlayer': {'playerActivity': 'IDLE'},
+        },
+        'request': {
+            'type': 'IntentRequest', 'requestId': 'amzn1.echo-api.request.0000',
+            'timestamp': '2019-01-01T00:00:00Z', 'locale': 'en-US', 'dialogState': 'COMPLETED',
+            'intent': {'name': 'BenchIntent', 'confirmationStatus': 'NONE', 'slots': slots},
+        },
+    }
+
+
+def handle(cls, payload):
+    body = cls(payload)
+    request = body.request
+    session = body.session
+    for name in request.intent.slots:
+        request.intent.slots[name].value
+    session.attributes.color
+    return body
+
+
+def measure(cls, payload, number=5000):
+    tracemalloc.start()
+    body = handle(cls, payload)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del body
+    seconds = timeit.timeit(lambda: handle(cls, payload), number=number)
+    return allocated, seconds / number * 1e6
+
+
+def access(body, number=100000):
+    request, session, context = body.request, body.session, body.context
+
+    def read():
+        request.type
+        request.requestId
+        request.locale
+        request.timestamp
+        session.new
+        session.attributes
+        session.user
+        context.System
+        context.AudioPlayer
+
+    read()
+    return number * 9 / timeit.timeit(read, number=number)
+
+
+def main():
+    payload = make_payload()
+    classes = (('original _Field', _EagerField), ('_Field', _Field), ('RequestBody', RequestBody))
+    for name, cls in classes:
+        allocated, usec = measure(cls, payload)
+        print('{:<18} {:>8} bytes allocated per request  {:>8.1f} us/request'.format(name, allocated, usec))
+    for name, cls in classes:
+        print('{:<18} {:>10.0f} attribute reads/s'.format(name, access(cls(payload))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Cost of reading the request, session and context locals from a view.
+
+Registers Ask on the last of twenty blueprints and reads the context locals
+inside a request to it, with the original find_ask, which searched the app
+and then every blueprint on each access, reproduced as the baseline.
+
+    python -m benchmarks.bench_proxies
+"""
+import json
+import timeit
+
+from flask import Flask, Blueprint, current_app
+from mock import patch
+
+from flask_ask import Ask, request, session, context, statement
+
+
+def original_find_ask():
+    """The original find_ask."""
+    if hasattr(current_app, 'ask'):
+        return getattr(current_app, 'ask')
+    else:
+        if hasattr(current_app, 'blueprints'):
+            blueprints = getattr(current_app, 'blueprints')
+            for blueprint_name in blueprints:
+                if hasattr(blueprints[blueprint_name], 'ask'):
+                    return getattr(blueprints[blueprint_name], 'ask')
+
+
+def main(number=100000):
+    app = Flask(__name__)
+    app.config['ASK_VERIFY_REQUESTS'] = False
+    for i in range(19):
+        app.register_blueprint(Blueprint('other{}'.format(i), __name__))
+    blueprint = Blueprint('skill', __name__, url_prefix='/ask')
+    ask = Ask(blueprint=blueprint)
+    app.register_blueprint(blueprint)
+    results = {}
+
+    def read():
+        request.type
+        session.attributes
+        context.System
+
+    @ask.launch
+    def launched():
+        read()
+        results['find_ask'] = timeit.timeit(read, number=number)
+        with patch('flask_ask.core.find_ask', original_find_ask):
+            results['original find_ask'] = timeit.timeit(read, number=number)
+        return statement('ok')
+
+    body = json.dumps({'version': '1.0', 'session': {'new': False, 'attributes': {}},
+                       'context': {'System': {}}, 'request': {'type': 'LaunchRequest'}})
+    assert app.test_client().post('/ask', data=body).status_code == 200
+    for name in ('original find_ask', 'find_ask'):
+        print('{:<18} {:6.3f} us per context local read'.format(name, results[name] / number / 3 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
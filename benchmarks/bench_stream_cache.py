@@ -0,0 +1,61 @@
+"""
+Stream cache throughput from several threads: SimpleCache, ShardedLRUCache and SQLiteCache.
+
+Each thread plays the part of a request thread handling AudioPlayer events
+for its share of users: it reads the user's stream stack and pushes a new
+stream, using the flask_ask.cache functions. Reports operations per second
+and, for ShardedLRUCache, the hit, miss and eviction counts.
+
+    python -m benchmarks.bench_stream_cache
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from werkzeug.contrib.cache import SimpleCache
+
+from flask_ask.cache import ShardedLRUCache, SQLiteCache, push_stream, top_stream
+
+
+def make_stream(i):
+    return {'url': 'https://example.com/episode-{:04d}.mp3'.format(i), 'token': str(uuid.uuid4()),
+            'offsetInMilliseconds': i * 1000}
+
+
+def run(cache, threads, users=800, ops_per_thread=5000):
+    streams = [make_stream(i) for i in range(100)]
+
+    def worker(n):
+        for i in range(ops_per_thread):
+            user = 'amzn1.ask.account.{}'.format((n * 7919 + i) % users)
+            top_stream(cache, user)
+            push_stream(cache, user, streams[i % len(streams)], max_depth=5)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.time()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return threads * ops_per_thread * 2 / (time.time() - start)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    for threads in (1, 8, 32):
+        for name, factory in (('SimpleCache', lambda: SimpleCache(threshold=1000)),
+                              ('ShardedLRUCache', lambda: ShardedLRUCache(max_size=1000)),
+                              ('SQLiteCache', lambda: SQLiteCache(os.path.join(directory, str(uuid.uuid4()))))):
+            cache = factory()
+            ops = run(cache, threads, ops_per_thread=5000 if name != 'SQLiteCache' else 500)
+            stats = ' '.join('{}={}'.format(k, v) for k, v in sorted(cache.stats().items())) \
+                if hasattr(cache, 'stats') else ''
+            print('{:>2} threads  {:<16} {:>9.0f} ops/s  {}'.format(threads, name, ops, stats))
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
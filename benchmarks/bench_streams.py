@@ -0,0 +1,37 @@
+"""
+Size and cost of stream stacks stored as lists of dicts and as packed StreamRecords.
+
+Pushes the streams of a long playlist onto one user's stack in a SimpleCache,
+unbounded and with ASK_STREAM_MAX_DEPTH-style trimming, and reports the
+pickled size of the stored stack and the time per push.
+
+    python -m benchmarks.bench_streams
+"""
+import pickle
+import timeit
+import uuid
+
+from werkzeug.contrib.cache import SimpleCache
+
+from flask_ask.cache import push_stream
+
+
+def make_stream(i):
+    return {'url': 'https://s3.amazonaws.com/example-podcast/episodes/episode-{:04d}.mp3'.format(i),
+            'token': str(uuid.uuid4()), 'offsetInMilliseconds': i * 1000}
+
+
+def main(pushes=500):
+    streams = [make_stream(i) for i in range(pushes)]
+    for max_depth in (None, 10):
+        for compact in (False, True):
+            cache = SimpleCache(default_timeout=0)
+            it = iter(streams)
+            seconds = timeit.timeit(lambda: push_stream(cache, 'user', next(it), max_depth, compact), number=pushes)
+            size = len(pickle.dumps(cache.get('user'), pickle.HIGHEST_PROTOCOL))
+            print('max_depth={:<5} compact={:<6} {:>7} bytes stored  {:7.1f} us/push'.format(
+                str(max_depth), str(compact), size, seconds / pushes * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+render_template throughput with each ASK_TEMPLATE_RELOAD_INTERVAL setting.
+
+Renders a template from a skill's templates.yaml, with Flask's
+TEMPLATES_AUTO_RELOAD on (the default in debug mode, where Jinja asks the
+loader whether each cached template is up to date) and off. With the
+interval None the yaml file is checked on every lookup, as YamlLoader
+originally did. Also reports YamlLoader.get_source calls per second, which
+is the cost of each Jinja template cache miss.
+
+    python -m benchmarks.bench_templates
+"""
+import os
+import shutil
+import tempfile
+import timeit
+
+from flask import Flask, render_template
+
+from flask_ask import Ask
+
+
+def main(number=20000):
+    root = tempfile.mkdtemp()
+    with open(os.path.join(root, 'templates.yaml'), 'w') as f:
+        f.write('welcome: Welcome back {{ name }}, you have {{ count }} new episodes\n')
+    try:
+        for auto_reload in (True, False):
+            for interval in (None, 60, 0):
+                app = Flask(__name__, root_path=root)
+                app.config['TEMPLATES_AUTO_RELOAD'] = auto_reload
+                app.config['ASK_TEMPLATE_RELOAD_INTERVAL'] = interval
+                ask = Ask(app, '/')
+                with app.app_context():
+                    seconds = timeit.timeit(lambda: render_template('welcome', name='Ada', count=3), number=number)
+                lookup = timeit.timeit(lambda: ask._template_loader.get_source(app.jinja_env, 'welcome'),
+                                       number=number)
+                print('TEMPLATES_AUTO_RELOAD={:<5} interval={:<4} {:9.0f} renders/s {:9.0f} lookups/s'.format(
+                    str(auto_reload), str(interval), number / seconds, number / lookup))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
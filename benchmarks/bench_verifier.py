@@ -0,0 +1,66 @@
+"""
+Signature verification throughput, per core.
+
+Compares the pyOpenSSL path (``crypto.verify`` on an X509, with the signature
+digest looked up on every call) with a VerifiedCertificate built once per
+certificate and verifying through the cryptography backend.
+
+    python -m benchmarks.bench_verifier
+"""
+import base64
+import timeit
+import warnings
+from datetime import datetime, timedelta
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+from OpenSSL import crypto
+
+from flask_ask import verifier
+
+
+def make_certificate():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'echo-api.amazon.com')])
+    now = datetime.utcnow()
+    cert = (x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(1000)
+            .not_valid_before(now - timedelta(days=1))
+            .not_valid_after(now + timedelta(days=30))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName(u'echo-api.amazon.com')]), critical=False)
+            .sign(key, hashes.SHA256(), default_backend()))
+    return key, cert.public_bytes(serialization.Encoding.PEM)
+
+
+def report(name, number, seconds):
+    print('{:<32} {:>10.0f} ops/s  {:>8.1f} us/op'.format(name, number / seconds, seconds / number * 1e6))
+
+
+def main(number=5000):
+    key, pem = make_certificate()
+    body = b'{"version": "1.0", "request": {"type": "LaunchRequest"}}' * 20
+    signature = base64.b64encode(key.sign(body, padding.PKCS1v15(), hashes.SHA1()))
+
+    x509_cert = crypto.load_certificate(crypto.FILETYPE_PEM, pem)
+    verified = verifier.VerifiedCertificate(pem)
+
+    def pyopenssl():
+        crypto.verify(x509_cert, base64.b64decode(signature), body, 'sha1')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        report('pyOpenSSL crypto.verify', number, timeit.timeit(pyopenssl, number=number))
+    report('VerifiedCertificate.verify', number,
+           timeit.timeit(lambda: verified.verify(signature, body), number=number))
+    report('VerifiedCertificate(pem) build', number // 10,
+           timeit.timeit(lambda: verifier.VerifiedCertificate(pem), number=number // 10))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,180 @@
 """
 Stream cache functions
 """
+import os
+import pickle
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 
 
-def push_stream(cache, user_id, stream):
+# flags, offset, then byte lengths of url, token and previous token
+_RECORD_HEADER = struct.Struct('!BqHHH')
+_HAS_OFFSET = 1
+_NO_STRING = 0xFFFF
+
+
+class StreamRecord(object):
+    """
+    Fixed-field form of a stream, packed into a few bytes for storage.
+
+    Only the url, token, offsetInMilliseconds and expectedPreviousToken of a
+    stream are kept. The url and tokens may be up to 65534 bytes of UTF-8.
+    """
+
+    __slots__ = ('url', 'token', 'offset', 'previous_token')
+
+    def __init__(self, url=None, token=None, offset=None, previous_token=None):
+        self.url = url
+        self.token = token
+        self.offset = offset
+        self.previous_token = previous_token
+
+    @classmethod
+    def from_stream(cls, stream):
+        """
+        :param stream: stream dict, as pushed by audio directives
+
+        :return: StreamRecord with the stream's fields
+        """
+        offset = stream.get('offsetInMilliseconds')
+        return cls(stream.get('url'), stream.get('token'),
+                   None if offset is None else int(offset), stream.get('expectedPreviousToken'))
+
+    def to_stream(self):
+        """
+        :return: stream dict holding the fields that are set
+        """
+        stream = {}
+        if self.url is not None:
+            stream['url'] = self.url
+        if self.token is not None:
+            stream['token'] = self.token
+        if self.offset is not None:
+            stream['offsetInMilliseconds'] = self.offset
+        if self.previous_token is not None:
+            stream['expectedPreviousToken'] = self.previous_token
+        return stream
+
+    def pack(self):
+        """
+        :return: bytes holding the record
+        """
+        fields = [_encode(self.url), _encode(self.token), _encode(self.previous_token)]
+        header = _RECORD_HEADER.pack(_HAS_OFFSET if self.offset is not None else 0, self.offset or 0,
+                                     *[_NO_STRING if f is None else len(f) for f in fields])
+        return header + b''.join(f for f in fields if f)
+
+    @classmethod
+    def unpack_from(cls, data, pos=0):
+        """
+        :param data: bytes holding packed records
+        :param pos: position of the record in data
+
+        :return: tuple of the record and the position following it
+        """
+        flags, offset, url_len, token_len, previous_len = _RECORD_HEADER.unpack_from(data, pos)
+        pos += _RECORD_HEADER.size
+        fields = []
+        for length in (url_len, token_len, previous_len):
+            if length == _NO_STRING:
+                fields.append(None)
+            else:
+                fields.append(data[pos:pos + length].decode('utf-8'))
+                pos += length
+        return cls(fields[0], fields[1], offset if flags & _HAS_OFFSET else None, fields[2]), pos
+
+
+def _encode(value):
+    if value is None:
+        return None
+    value = value.encode('utf-8')
+    if len(value) >= _NO_STRING:
+        raise ValueError('Stream url and tokens must be shorter than {} bytes'.format(_NO_STRING))
+    return value
+
+
+def pack_streams(stack):
+    """
+    Pack a stack of stream dicts into bytes.
+
+    :param stack: list of stream dicts
+
+    :return: bytes holding one StreamRecord per stream
+    """
+    return b''.join(StreamRecord.from_stream(stream).pack() for stream in stack)
+
+
+def unpack_streams(data):
+    """
+    Unpack a stack packed with pack_streams.
+
+    :param data: bytes holding packed records
+
+    :return: list of stream dicts
+    """
+    stack = []
+    pos = 0
+    while pos < len(data):
+        record, pos = StreamRecord.unpack_from(data, pos)
+        stack.append(record.to_stream())
+    return stack
+
+
+def _record_positions(data):
+    positions = []
+    pos = 0
+    while pos < len(data):
+        positions.append(pos)
+        lengths = _RECORD_HEADER.unpack_from(data, pos)[2:]
+        pos += _RECORD_HEADER.size + sum(length for length in lengths if length != _NO_STRING)
+    return positions
+
+
+def _load(value):
+    if isinstance(value, bytes):
+        return unpack_streams(value)
+    return list(value or [])
+
+
+def _store(stack, max_depth=None, compact=False):
+    if max_depth is not None and len(stack) > max_depth:
+        stack = stack[len(stack) - max_depth:]
+    if compact:
+        return pack_streams(stack)
+    return stack
+
+
+def push_stream(cache, user_id, stream, max_depth=None, compact=False):
     """
     Push a stream onto the stream stack in cache.
 
     :param cache: werkzeug BasicCache-like object
     :param user_id: id of user, used as key in cache
     :param stream: stream object to push onto stack
+    :param max_depth: number of streams kept, dropping the oldest; None keeps all
+    :param compact: store the stack packed as StreamRecords instead of a list of dicts
 
     :return: True on successful update,
              False if failed to update,
              None if invalid input was given
     """
-    stack = cache.get(user_id)
-    if stack is None:
-        stack = []
-    if stream:
-        stack.append(stream)
-        return cache.set(user_id, stack)
-    return None
+    value = cache.get(user_id)
+    if not stream:
+        return None
+    if compact and (not value or isinstance(value, bytes)):
+        # append to the packed stack without unpacking it
+        data = (value or b'') + StreamRecord.from_stream(stream).pack()
+        if max_depth is not None:
+            positions = _record_positions(data)
+            if len(positions) > max_depth:
+                data = data[positions[len(positions) - max_depth]:] if max_depth else b''
+        return cache.set(user_id, data)
+    stack = _load(value)
+    stack.append(stream)
+    return cache.set(user_id, _store(stack, max_depth, compact))
 
 
 def pop_stream(cache, user_id):
@@ -34,32 +187,34 @@ def pop_stream(cache, user_id):
 
     :return: top item from stack, otherwise None
     """
-    stack = cache.get(user_id)
-    if stack is None:
+    value = cache.get(user_id)
+    if not value:
         return None
 
+    stack = _load(value)
     result = stack.pop()
 
     if len(stack) == 0:
         cache.delete(user_id)
     else:
-        cache.set(user_id, stack)
+        cache.set(user_id, _store(stack, compact=isinstance(value, bytes)))
 
     return result
 
 
-def set_stream(cache, user_id, stream):
+def set_stream(cache, user_id, stream, compact=False):
     """
     Overwrite stack in the cache.
 
-    :param cache: werkzeug BasicCache-liek object
+    :param cache: werkzeug BasicCache-like object
     :param user_id: id of user, used as key in cache
     :param stream: value to initialize new stack with
+    :param compact: store the stack packed as StreamRecords instead of a list of dicts
 
     :return: None
     """
     if stream:
-        return cache.set(user_id, [stream])
+        return cache.set(user_id, _store([stream], compact=compact))
 
 
 def top_stream(cache, user_id):
@@ -73,8 +228,515 @@ def top_stream(cache, user_id):
     """
     if not user_id:
         return None
-    
+    if hasattr(cache, 'stream_top'):
+        return cache.stream_top(user_id)
+
     stack = cache.get(user_id)
-    if stack is None:
+    if not stack:
+        return None
+    if isinstance(stack, bytes):
+        return StreamRecord.unpack_from(stack, _record_positions(stack)[-1])[0].to_stream()
+    return stack[-1]
+
+
+def apply_stream_ops(stack, ops, max_depth=None, compact=False):
+    """
+    Replay recorded stream operations on a stack.
+
+    :param stack: list of streams, packed streams, or None for an empty stack
+    :param ops: sequence of ('set', stream) and ('push', stream) pairs
+    :param max_depth: number of streams kept, dropping the oldest; None keeps all
+    :param compact: return the stack packed as StreamRecords instead of a list of dicts
+
+    :return: new stack with the operations applied; stack is not modified
+    """
+    stack = _load(stack)
+    for op, stream in ops:
+        if op == 'set':
+            stack = [stream]
+        else:
+            stack.append(stream)
+    return _store(stack, max_depth, compact)
+
+
+class StreamUnitOfWork(object):
+    """
+    Changes to one user's stream stack, gathered during a request and committed in one write.
+
+    The stack is read once when the unit of work is created and changes are applied
+    to that copy, so reads see them straight away. A cache with both ``stream_top``
+    and ``apply_stream_ops`` never needs the whole stack, so only its top stream is
+    read. commit() then stores the result in the way the cache supports best:
+
+    - ``apply_stream_ops(user_id, ops, max_depth, compact)``: the cache applies the
+      recorded operations itself, atomically, keeping at most max_depth streams.
+    - ``get_for_update(user_id)`` returning ``(value, version)`` and
+      ``compare_and_set(user_id, value, version)``: the stack is written only if it
+      was not changed since it was read. Otherwise the operations are replayed on
+      the latest stack and the write is retried.
+    - Otherwise the stack is written with a single ``set``.
+
+    :param cache: werkzeug BasicCache-like object
+    :param user_id: id of user, used as key in cache
+    :param retries: compare-and-set attempts after the first one before giving up
+    :param max_depth: number of streams kept, dropping the oldest; None keeps all
+    :param compact: store the stack packed as StreamRecords instead of a list of dicts
+    """
+
+    def __init__(self, cache, user_id, retries=3, max_depth=None, compact=False):
+        self.cache = cache
+        self.user_id = user_id
+        self.retries = retries
+        self.max_depth = max_depth
+        self.compact = compact
+        self.ops = []
+        if hasattr(cache, 'stream_top') and hasattr(cache, 'apply_stream_ops'):
+            top, self._version = cache.stream_top(user_id), None
+            stack = [top] if top else []
+        elif hasattr(cache, 'get_for_update'):
+            stack, self._version = cache.get_for_update(user_id)
+        else:
+            stack, self._version = cache.get(user_id), None
+        self.stack = _load(stack)
+
+    def top(self):
+        """
+        :return: top item of the stack, otherwise None
+        """
+        return self.stack[-1] if self.stack else None
+
+    def set(self, stream):
+        """
+        Replace the stack with a single stream.
+
+        :param stream: value to initialize new stack with
+        """
+        if stream:
+            self.ops.append(('set', stream))
+            self.stack = [stream]
+
+    def push(self, stream):
+        """
+        Push a stream onto the stack.
+
+        :param stream: stream object to push onto stack
+
+        :return: True if the stream was recorded, None if invalid input was given
+        """
+        if stream:
+            self.ops.append(('push', stream))
+            self.stack.append(stream)
+            return True
         return None
-    return stack.pop()
+
+    def commit(self):
+        """
+        Write the recorded changes to the cache.
+
+        :return: True on successful update or if there was nothing to write,
+                 False if failed to update
+        """
+        if not self.ops:
+            return True
+        if hasattr(self.cache, 'apply_stream_ops'):
+            result = self.cache.apply_stream_ops(self.user_id, self.ops, self.max_depth, compact=self.compact)
+        elif hasattr(self.cache, 'compare_and_set'):
+            result = self._compare_and_set()
+        else:
+            result = self.cache.set(self.user_id, _store(self.stack, self.max_depth, self.compact))
+        if result:
+            self.ops = []
+        return result
+
+    def _compare_and_set(self):
+        for attempt in range(self.retries + 1):
+            if self.cache.compare_and_set(self.user_id, _store(self.stack, self.max_depth, self.compact),
+                                          self._version):
+                return True
+            latest, self._version = self.cache.get_for_update(self.user_id)
+            self.stack = apply_stream_ops(latest, self.ops, self.max_depth)
+        return False
+
+
+class _Shard(object):
+
+    __slots__ = ('entries', 'lock', 'version', 'hits', 'misses', 'evictions', 'expirations')
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+class ShardedLRUCache(object):
+    """
+    Thread-safe in-process stream cache with least-recently-used eviction.
+
+    Keys are spread over ``shards`` independently locked shards, so requests for
+    different users rarely wait on each other. Each shard holds at most its share
+    of ``max_size`` entries and evicts the least recently used one when full.
+    Entries expire ``timeout`` seconds after they are set.
+
+    Values are stored by reference rather than pickled, so they must not be
+    modified after being stored or once read back. The stream cache functions
+    in this module never modify them.
+
+    Implements the werkzeug BasicCache methods used by Flask-Ask, plus
+    ``get_for_update``/``compare_and_set`` and ``apply_stream_ops`` so that
+    stream changes are committed atomically.
+
+    :param max_size: maximum number of entries held across all shards
+    :param shards: number of shards
+    :param default_timeout: seconds entries are kept when set without a timeout;
+                            0 keeps them until evicted
+    """
+
+    def __init__(self, max_size=10000, shards=16, default_timeout=300):
+        self.default_timeout = default_timeout
+        self._shards = [_Shard() for _ in range(shards)]
+        self._shard_size = max(1, max_size // shards)
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _expires(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout if timeout > 0 else 0
+
+    def _lookup(self, shard, key):
+        # call with shard.lock held; returns the live entry and marks it most recently used
+        entry = shard.entries.pop(key, None)
+        if entry is None:
+            return None
+        if entry[0] and entry[0] <= time.time():
+            shard.expirations += 1
+            return None
+        shard.entries[key] = entry
+        return entry
+
+    def _store(self, shard, key, value, timeout):
+        # call with shard.lock held
+        shard.entries.pop(key, None)
+        while len(shard.entries) >= self._shard_size:
+            shard.entries.popitem(last=False)
+            shard.evictions += 1
+        shard.version += 1
+        shard.entries[key] = (self._expires(timeout), value, shard.version)
+        return True
+
+    def get(self, key):
+        """
+        :param key: cache key
+
+        :return: stored value, otherwise None if missing or expired
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            entry = self._lookup(shard, key)
+            if entry is None:
+                shard.misses += 1
+                return None
+            shard.hits += 1
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        """
+        :param key: cache key
+        :param value: value to store
+        :param timeout: seconds until the entry expires; None uses default_timeout, 0 never expires
+
+        :return: True
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            return self._store(shard, key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        """
+        Store value only if key is not already cached.
+
+        :return: True if stored, False if key was present
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            if self._lookup(shard, key) is not None:
+                return False
+            return self._store(shard, key, value, timeout)
+
+    def delete(self, key):
+        """
+        :return: True if key was cached
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.entries.pop(key, None) is not None
+
+    def has(self, key):
+        shard = self._shard(key)
+        with shard.lock:
+            return self._lookup(shard, key) is not None
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+        return True
+
+    def get_for_update(self, key):
+        """
+        Read a value along with its version, for a later compare_and_set.
+
+        :return: tuple of the value (None if missing) and its version
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            entry = self._lookup(shard, key)
+            if entry is None:
+                shard.misses += 1
+                return None, 0
+            shard.hits += 1
+            return entry[1], entry[2]
+
+    def compare_and_set(self, key, value, version, timeout=None):
+        """
+        Store value only if key still has the version returned by get_for_update.
+
+        :return: True if stored, False if the entry changed in between
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            entry = self._lookup(shard, key)
+            if (entry[2] if entry is not None else 0) != version:
+                return False
+            return self._store(shard, key, value, timeout)
+
+    def apply_stream_ops(self, user_id, ops, max_depth=None, compact=False):
+        """
+        Atomically apply stream operations recorded by a StreamUnitOfWork.
+
+        :return: True
+        """
+        shard = self._shard(user_id)
+        with shard.lock:
+            entry = self._lookup(shard, user_id)
+            stack = apply_stream_ops(entry[1] if entry is not None else None, ops, max_depth, compact)
+            return self._store(shard, user_id, stack, None)
+
+    def stats(self):
+        """
+        :return: dict with the number of entries and the hits, misses, evictions and
+                 expirations counted across all shards
+        """
+        totals = dict.fromkeys(('entries', 'hits', 'misses', 'evictions', 'expirations'), 0)
+        for shard in self._shards:
+            with shard.lock:
+                totals['entries'] += len(shard.entries)
+                totals['hits'] += shard.hits
+                totals['misses'] += shard.misses
+                totals['evictions'] += shard.evictions
+                totals['expirations'] += shard.expirations
+        return totals
+
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self._shards)
+
+
+class SQLiteCache(object):
+    """
+    Stream cache in a local SQLite database, shared by every process on the host.
+
+    With a per-process cache such as SimpleCache, AudioPlayer events for one user
+    that reach different workers see different streams. Pointing every worker's
+    stream_cache at the same file keeps them in step without an external service.
+
+    The database runs in WAL mode so readers do not block the writer. Each thread
+    of each process gets its own connection, which caches the compiled statements.
+    Values are pickled. Every entry carries a version for compare_and_set, and
+    apply_stream_ops updates a stack inside a single write transaction. Expired
+    entries are deleted at most every ``cleanup_interval`` seconds, when writing.
+
+    :param path: database file, created if missing
+    :param default_timeout: seconds entries are kept when set without a timeout;
+                            0 keeps them until deleted
+    :param cleanup_interval: minimum seconds between deletions of expired entries
+    :param busy_timeout: seconds to wait for another process's write transaction
+    """
+
+    _GET = 'SELECT value, expires, version FROM stream_cache WHERE key = ?'
+    _SET = ('INSERT OR REPLACE INTO stream_cache (key, value, expires, version) VALUES '
+            '(?, ?, ?, COALESCE((SELECT version FROM stream_cache WHERE key = ?), 0) + 1)')
+    _UPDATE = 'UPDATE stream_cache SET value = ?, expires = ?, version = version + 1 WHERE key = ? AND version = ?'
+    _INSERT = 'INSERT OR IGNORE INTO stream_cache (key, value, expires, version) VALUES (?, ?, ?, 1)'
+    _DELETE = 'DELETE FROM stream_cache WHERE key = ?'
+    _DELETE_EXPIRED_KEY = 'DELETE FROM stream_cache WHERE key = ? AND expires != 0 AND expires <= ?'
+    _DELETE_EXPIRED = 'DELETE FROM stream_cache WHERE expires != 0 AND expires <= ?'
+
+    def __init__(self, path, default_timeout=300, cleanup_interval=60, busy_timeout=5):
+        self.path = path
+        self.default_timeout = default_timeout
+        self.cleanup_interval = cleanup_interval
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._next_cleanup = 0
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS stream_cache '
+                         '(key TEXT PRIMARY KEY, value BLOB, expires REAL, version INTEGER)')
+
+    def _connection(self):
+        # connections must not cross a fork, so each process opens its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _expires(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout if timeout > 0 else 0
+
+    def _row(self, conn, key):
+        row = conn.execute(self._GET, (key,)).fetchone()
+        if row is None or (row[1] and row[1] <= time.time()):
+            return None
+        return row
+
+    def _cleanup(self, conn):
+        now = time.time()
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + self.cleanup_interval
+            conn.execute(self._DELETE_EXPIRED, (now,))
+
+    def get(self, key):
+        """
+        :param key: cache key
+
+        :return: stored value, otherwise None if missing or expired
+        """
+        row = self._row(self._connection(), key)
+        return pickle.loads(row[0]) if row is not None else None
+
+    def get_many(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        """
+        :param key: cache key
+        :param value: picklable value to store
+        :param timeout: seconds until the entry expires; None uses default_timeout, 0 never expires
+
+        :return: True
+        """
+        with self._transaction() as conn:
+            self._cleanup(conn)
+            conn.execute(self._SET, (key, _dumps(value), self._expires(timeout), key))
+        return True
+
+    def set_many(self, mapping, timeout=None):
+        """
+        Store several values in one transaction.
+
+        :param mapping: dict of keys to values
+        :param timeout: as for set
+
+        :return: True
+        """
+        expires = self._expires(timeout)
+        with self._transaction() as conn:
+            self._cleanup(conn)
+            conn.executemany(self._SET, [(key, _dumps(value), expires, key) for key, value in mapping.items()])
+        return True
+
+    def add(self, key, value, timeout=None):
+        """
+        Store value only if key is not already cached.
+
+        :return: True if stored, False if key was present
+        """
+        with self._transaction() as conn:
+            conn.execute(self._DELETE_EXPIRED_KEY, (key, time.time()))
+            return conn.execute(self._INSERT, (key, _dumps(value), self._expires(timeout))).rowcount == 1
+
+    def delete(self, key):
+        """
+        :return: True if key was cached
+        """
+        with self._transaction() as conn:
+            return conn.execute(self._DELETE, (key,)).rowcount == 1
+
+    def has(self, key):
+        return self._row(self._connection(), key) is not None
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM stream_cache')
+        return True
+
+    def get_for_update(self, key):
+        """
+        Read a value along with its version, for a later compare_and_set.
+
+        :return: tuple of the value (None if missing) and its version
+        """
+        row = self._row(self._connection(), key)
+        if row is None:
+            return None, 0
+        return pickle.loads(row[0]), row[2]
+
+    def compare_and_set(self, key, value, version, timeout=None):
+        """
+        Store value only if key still has the version returned by get_for_update.
+
+        :return: True if stored, False if the entry changed in between
+        """
+        with self._transaction() as conn:
+            if version == 0:
+                conn.execute(self._DELETE_EXPIRED_KEY, (key, time.time()))
+                cursor = conn.execute(self._INSERT, (key, _dumps(value), self._expires(timeout)))
+            else:
+                cursor = conn.execute(self._UPDATE, (_dumps(value), self._expires(timeout), key, version))
+            return cursor.rowcount == 1
+
+    def apply_stream_ops(self, user_id, ops, max_depth=None, compact=False):
+        """
+        Apply stream operations recorded by a StreamUnitOfWork in one write transaction.
+
+        :return: True
+        """
+        with self._transaction() as conn:
+            row = self._row(conn, user_id)
+            stack = apply_stream_ops(pickle.loads(row[0]) if row is not None else None, ops, max_depth, compact)
+            conn.execute(self._SET, (user_id, _dumps(stack), self._expires(None), user_id))
+        return True
+
+    def close(self):
+        """Close the calling thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _dumps(value):
+    import sqlite3
+    return sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
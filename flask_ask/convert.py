@@ -1,8 +1,6 @@
 import re
 from datetime import datetime, time
 
-import aniso8601
-
 from . import logger
 
 
@@ -19,12 +17,23 @@ _DATE_PATTERNS = {
     '^\d{4}$': '%Y',
 }
 
+# _DATE_PATTERNS compiled by _date_patterns on first use
+_COMPILED_DATE_PATTERNS = None
+
+
+def _date_patterns():
+    global _COMPILED_DATE_PATTERNS
+    if _COMPILED_DATE_PATTERNS is None:
+        _COMPILED_DATE_PATTERNS = [(re.compile(re_pattern), format_pattern)
+                                   for re_pattern, format_pattern in _DATE_PATTERNS.items()]
+    return _COMPILED_DATE_PATTERNS
+
 
 def to_date(amazon_date):
     # make so 'next decade' matches work against 'next year' regex
     amazon_date = re.sub('X$', '0', amazon_date)
-    for re_pattern, format_pattern in list(_DATE_PATTERNS.items()):
-        if re.match(re_pattern, amazon_date):
+    for re_pattern, format_pattern in _date_patterns():
+        if re_pattern.match(amazon_date):
             if '%U' in format_pattern:
                 # http://stackoverflow.com/a/17087427/1163855
                 amazon_date += '-0'
@@ -45,6 +54,7 @@ def to_time(amazon_time):
         return time(hour=17)
     if amazon_time == "NI":
         return time(hour=21)
+    import aniso8601
     try:
         return aniso8601.parse_time(amazon_time)
     except ValueError as e:
@@ -54,4 +64,5 @@ def to_time(amazon_time):
 
 
 def to_timedelta(amazon_duration):
+    import aniso8601
     return aniso8601.parse_duration(amazon_duration)
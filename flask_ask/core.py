@@ -1,47 +1,91 @@
 import os
 import sys
-import yaml
+import logging
 import inspect
 import io
+import time
+import threading
+import weakref
 from datetime import datetime
 from functools import wraps, partial
 
-import aniso8601
-from werkzeug.contrib.cache import SimpleCache
 from werkzeug.local import LocalProxy, LocalStack
 from jinja2 import BaseLoader, ChoiceLoader, TemplateNotFound
-from flask import current_app, json, request as flask_request, _app_ctx_stack
+from flask import current_app, request as flask_request, _app_ctx_stack, has_request_context
 
 from . import verifier, logger
+from .json_backends import get_backend
 from .convert import to_date, to_time, to_timedelta
-from .cache import top_stream, set_stream
-import collections
+from .cache import push_stream, top_stream, set_stream, StreamUnitOfWork
 
 
 def find_ask():
     """
     Find our instance of Ask, navigating Local's and possible blueprints.
 
-    Note: This only supports returning a reference to the first instance
-    of Ask found.
+    The Ask instance handling the current request is pinned to the app context,
+    so this is a single attribute lookup from within a view. Elsewhere, the Ask
+    instance of the current request's blueprint is preferred, then the app's,
+    then the first blueprint's, and the result is remembered for the rest of
+    the app context.
     """
-    if hasattr(current_app, 'ask'):
-        return getattr(current_app, 'ask')
-    else:
-        if hasattr(current_app, 'blueprints'):
-            blueprints = getattr(current_app, 'blueprints')
-            for blueprint_name in blueprints:
-                if hasattr(blueprints[blueprint_name], 'ask'):
-                    return getattr(blueprints[blueprint_name], 'ask')
-
-
-def dbgdump(obj, default=None, cls=None):
+    ctx = _app_ctx_stack.top
+    ask = getattr(ctx, '_ask', None)
+    if ask is not None:
+        return ask
+
+    if has_request_context() and flask_request.blueprint is not None:
+        ask = getattr(current_app.blueprints.get(flask_request.blueprint), 'ask', None)
+    if ask is None and hasattr(current_app, 'ask'):
+        ask = getattr(current_app, 'ask')
+    if ask is None and hasattr(current_app, 'blueprints'):
+        blueprints = getattr(current_app, 'blueprints')
+        for blueprint_name in blueprints:
+            if hasattr(blueprints[blueprint_name], 'ask'):
+                ask = getattr(blueprints[blueprint_name], 'ask')
+                break
+    if ctx is not None and ask is not None:
+        ctx._ask = ask
+    return ask
+
+
+def json_backend():
+    """The JSON backend selected by the current app's ASK_JSON_BACKEND setting."""
+    return get_backend(current_app.config.get('ASK_JSON_BACKEND', 'flask'))
+
+
+class _DebugDump(object):
+    """Log message that serializes its object only when a handler formats it."""
+
+    __slots__ = ('obj', 'backend', 'indent', 'default', 'cls')
+
+    def __init__(self, obj, backend, indent=None, default=None, cls=None):
+        self.obj = obj
+        self.backend = backend
+        self.indent = indent
+        self.default = default
+        self.cls = cls
+
+    def __str__(self):
+        return self.backend.dumps(self.obj, indent=self.indent, default=self.default, cls=self.cls)
+
+
+def dbgdump(obj, default=None, cls=None, event=None):
+    """Log obj as JSON at DEBUG level.
+
+    Nothing is serialized unless a handler emits the record. The record also
+    carries the object itself as ``ask_data`` and the kind of dump ('request',
+    'response' or 'stream') as ``ask_event``, for handlers that would rather
+    log structured data than the JSON text.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     if current_app.config.get('ASK_PRETTY_DEBUG_LOGS', False):
         indent = 2
     else:
         indent = None
-    msg = json.dumps(obj, indent=indent, default=default, cls=cls)
-    logger.debug(msg)
+    msg = _DebugDump(obj, json_backend(), indent=indent, default=default, cls=cls)
+    logger.debug(msg, extra={'ask_event': event, 'ask_data': obj})
 
 
 request = LocalProxy(lambda: find_ask().request)
@@ -51,12 +95,92 @@ context = LocalProxy(lambda: find_ask().context)
 convert_errors = LocalProxy(lambda: find_ask().convert_errors)
 current_stream = LocalProxy(lambda: find_ask().current_stream)
 stream_cache = LocalProxy(lambda: find_ask().stream_cache)
+_current_ask = LocalProxy(lambda: find_ask())
 
 from . import models
 
 
 _converters = {'date': to_date, 'time': to_time, 'timedelta': to_timedelta}
 
+# values run through each converter by Ask.warm_up
+_converter_samples = {'date': '2015-11-25', 'time': '10:30', 'timedelta': 'PT1H'}
+
+_WARM_UP_USER_ID = 'amzn1.ask.account.flask-ask-warm-up'
+
+
+def _warm_up_event(request_type):
+    """A minimal request of the given type, dispatched by Ask.warm_up.
+
+    Its session is not new, so the on_session_started callback is not run.
+    """
+    system = {'application': {'applicationId': 'flask-ask-warm-up'}, 'user': {'userId': _WARM_UP_USER_ID}}
+    return {
+        'version': '1.0',
+        'session': {'new': False, 'sessionId': 'flask-ask-warm-up', 'attributes': {},
+                    'application': system['application'], 'user': system['user']},
+        'context': {'System': system},
+        'request': {'type': request_type, 'requestId': 'flask-ask-warm-up', 'locale': 'en-US',
+                    'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')},
+    }
+
+
+def _arg_names(view_func):
+    if hasattr(inspect, 'getfullargspec'):
+        return inspect.getfullargspec(view_func).args
+    return inspect.getargspec(view_func).args
+
+
+class _ViewBinder(object):
+    """A view function with its parameter mapping, converters and defaults resolved up front.
+
+    Built once when a view is registered, so that dispatching a request only has to
+    look up each parameter's value and apply its converter or default.
+    """
+
+    __slots__ = ('view_func', 'params')
+
+    def __init__(self, view_func, mapping=None, convert=None, default=None):
+        mapping = mapping or {}
+        convert = convert or {}
+        default = default or {}
+        params = []
+        for arg_name in _arg_names(view_func):
+            convert_func = convert.get(arg_name)
+            if convert_func in _converters:
+                convert_func = _converters[convert_func]
+            default_value = default.get(arg_name)
+            params.append((arg_name, mapping.get(arg_name, arg_name), convert_func,
+                           arg_name in default, default_value, callable(default_value)))
+        self.view_func = view_func
+        self.params = tuple(params)
+
+    def bind(self, request_data):
+        """Returns the view function applied to its parameters from request_data, and any conversion errors."""
+        arg_values = []
+        convert_errors = {}
+        for arg_name, key, convert_func, has_default, default_value, is_factory in self.params:
+            arg_value = request_data.get(key)
+            if arg_value is None or arg_value == "":
+                if has_default:
+                    arg_value = default_value() if is_factory else default_value
+            elif convert_func is not None:
+                try:
+                    arg_value = convert_func(arg_value)
+                except Exception as e:
+                    convert_errors[arg_name] = e
+            arg_values.append(arg_value)
+        return partial(self.view_func, *arg_values), convert_errors
+
+
+class _StreamState(object):
+    """Stream stacks changed by an Ask instance during one request, committed when it ends."""
+
+    __slots__ = ('ask', 'works')
+
+    def __init__(self, ask):
+        self.ask = ask
+        self.works = {}
+
 
 class Ask(object):
     """The Ask object provides the central interface for interacting with the Alexa service.
@@ -72,31 +196,59 @@ class Ask(object):
         route {str} -- entry point to which initial Alexa Requests are forwarded (default: {None})
         blueprint {Flask blueprint} -- Flask Blueprint instance to use instead of Flask App (default: {None})
         stream_cache {Werkzeug BasicCache} -- BasicCache-like object for storing Audio stream data (default: {SimpleCache})
+            flask_ask.cache.ShardedLRUCache is better suited to threaded servers,
+            flask_ask.cache.SQLiteCache shares streams between the worker processes of a host, and
+            flask_ask.redis_cache.RedisStreamCache shares them between hosts
+        cert_cache {verifier.CertificateCache} -- cache for request signing certificates (default: {CertificateCache})
+        replay_cache {Werkzeug BasicCache} -- BasicCache-like object recording request IDs when
+            ASK_VERIFY_REPLAY is set (default: {RequestIdCache})
         path {str} -- path to templates yaml file for VUI dialog (default: {'templates.yaml'})
     """
 
-    def __init__(self, app=None, route=None, blueprint=None, stream_cache=None, path='templates.yaml'):
+    def __init__(self, app=None, route=None, blueprint=None, stream_cache=None, path='templates.yaml',
+                 cert_cache=None, replay_cache=None):
         self.app = app
         self._route = route
-        self._intent_view_funcs = {}
-        self._intent_converts = {}
-        self._intent_defaults = {}
-        self._intent_mappings = {}
-        self._launch_view_func = None
-        self._session_ended_view_func = None
+        self._view_binders = {}
+        self._request_handlers = {
+            'SessionEndedRequest': lambda: ("{}", 200),
+            'IntentRequest': self._dispatch_intent,
+        }
         self._on_session_started_callback = None
-        self._default_intent_view_func = None
-        self._player_request_view_funcs = {}
-        self._player_mappings = {}
-        self._player_converts = {}
+        self._default_intent_binder = None
+        self.cert_refresher = None
+        self._stream_cache_lock = threading.Lock()
+        self._buffer_streams = False
+        self._lambda_environ_template = None
+        self._template_loader = None
+        if cert_cache is None:
+            self.cert_cache = verifier.CertificateCache()
+        else:
+            self.cert_cache = cert_cache
+        if replay_cache is None:
+            self.replay_cache = verifier.RequestIdCache()
+        else:
+            self.replay_cache = replay_cache
         if app is not None:
             self.init_app(app, path)
         elif blueprint is not None:
             self.init_blueprint(blueprint, path)
-        if stream_cache is None:
-            self.stream_cache = SimpleCache()
-        else:
-            self.stream_cache = stream_cache
+        self._stream_cache = stream_cache
+
+    @property
+    def stream_cache(self):
+        """Cache of audio stream stacks, a SimpleCache created on first use unless one was given."""
+        if self._stream_cache is None:
+            # created once, so concurrent first requests do not write to separate caches
+            with self._stream_cache_lock:
+                if self._stream_cache is None:
+                    from werkzeug.contrib.cache import SimpleCache
+                    self._stream_cache = SimpleCache()
+        return self._stream_cache
+
+    @stream_cache.setter
+    def stream_cache(self, value):
+        self._stream_cache = value
 
     def init_app(self, app, path='templates.yaml'):
         """Initializes Ask app by setting configuration variables, loading templates, and maps Ask route to a flask view.
@@ -130,6 +282,72 @@ class Ask(object):
             Add tabs and linebreaks to the Alexa request and response printed to the debug log.
             This improves readability when printing to the console, but breaks formatting when logging to CloudWatch.
             Default: False
+
+        `ASK_CERT_REFRESH_AHEAD`:
+
+            Start a background thread that re-fetches every signing certificate seen by the skill
+            this many seconds before it expires, so requests never wait on a certificate download.
+            Default: None (disabled)
+
+        `ASK_CERT_REFRESH_INTERVAL`:
+
+            Seconds between passes of the certificate refresh thread.
+            Default: 60
+
+        `ASK_CERT_URLS`:
+
+            Certificate chain URLs fetched by the refresh thread as soon as it starts, for warm starts.
+            Default: []
+
+        `ASK_VERIFY_REPLAY`:
+
+            Reject requests whose requestId was already seen within the timestamp window.
+            IDs are remembered in the replay_cache given to the constructor, which can be
+            a shared cache when running several workers.
+            Default: False
+
+        `ASK_TYPED_MODELS`:
+
+            Build `request`, `session` and `context` from compact slotted classes instead of
+            dicts. Common fields such as `request.intent.slots` and `session.attributes` are
+            read as plain attributes, and any other field falls back to a dict view.
+            Default: False
+
+        `ASK_JSON_BACKEND`:
+
+            JSON library used to parse requests and render responses: 'flask' (honors the app's
+            json_encoder), 'json', 'ujson', 'orjson', or 'auto' for the fastest one installed.
+            Falls back to the standard library if the chosen one is not installed.
+            Default: 'flask'
+
+        `ASK_STREAM_MAX_DEPTH`:
+
+            Number of audio streams kept on each user's stream stack in the stream_cache.
+            The oldest streams are dropped first. Only the top stream is used for playback.
+            Default: None (unbounded)
+
+        `ASK_STREAM_RECORDS`:
+
+            Store stream stacks as packed binary StreamRecords holding the url, token, offset
+            and expected previous token of each stream, instead of lists of dicts. Stacks in
+            either form are read back transparently. RedisStreamCache keeps its native lists
+            and ignores this setting.
+            Default: False
+
+        `ASK_TEMPLATE_RELOAD_INTERVAL`:
+
+            Seconds between checks of the templates yaml file for changes. 0 only reloads it when
+            reload_templates is called. None checks the file on every template lookup, which is
+            convenient while developing but costs two system calls per rendered template.
+            Jinja only looks up compiled templates again when `TEMPLATES_AUTO_RELOAD` is on, so
+            with it off (the default outside debug mode) use reload_templates to pick up changes.
+            Default: None
+
+        `ASK_WARM_UP`:
+
+            Call warm_up at the end of init_app, so that templates, converters, the JSON backend
+            and the certificates in `ASK_CERT_URLS` are loaded before the first request.
+            Default: False
         """
         if self._route is None:
             raise TypeError("route is a required argument when app is not None")
@@ -139,7 +357,17 @@ class Ask(object):
         app.ask = self
 
         app.add_url_rule(self._route, view_func=self._flask_view_func, methods=['POST'])
-        app.jinja_loader = ChoiceLoader([app.jinja_loader, YamlLoader(app, path)])
+        self._template_loader = YamlLoader(app, path, app.config.get('ASK_TEMPLATE_RELOAD_INTERVAL'))
+        app.jinja_loader = ChoiceLoader([app.jinja_loader, self._template_loader])
+        self._register_stream_teardown(app)
+
+        lead_time = app.config.get('ASK_CERT_REFRESH_AHEAD')
+        if lead_time is not None:
+            self.start_cert_refresher(app.config.get('ASK_CERT_URLS', []), lead_time,
+                                      app.config.get('ASK_CERT_REFRESH_INTERVAL', 60))
+
+        if app.config.get('ASK_WARM_UP', False):
+            self.warm_up()
 
     def init_blueprint(self, blueprint, path='templates.yaml'):
         """Initialize a Flask Blueprint, similar to init_app, but without the access
@@ -160,7 +388,82 @@ class Ask(object):
         # Blueprint('blueprint_api', __name__, url_prefix="/ask") to result in
         # exposing the rule at "/ask" and not "/ask/".
         blueprint.add_url_rule("", view_func=self._flask_view_func, methods=['POST'])
-        blueprint.jinja_loader = ChoiceLoader([YamlLoader(blueprint, path)])
+        blueprint.record_once(lambda state: self._register_stream_teardown(state.app))
+        self._template_loader = YamlLoader(blueprint, path)
+        blueprint.jinja_loader = ChoiceLoader([self._template_loader])
+        blueprint.record_once(lambda state: setattr(self._template_loader, 'reload_interval',
+                                                    state.app.config.get('ASK_TEMPLATE_RELOAD_INTERVAL')))
+
+    def start_cert_refresher(self, cert_urls=(), lead_time=3600, interval=60):
+        """Start refreshing signing certificates in the background.
+
+        Every certificate URL seen while verifying requests is tracked, and re-fetched
+        `lead_time` seconds before it expires. This is started by init_app when
+        `ASK_CERT_REFRESH_AHEAD` is set, and can be called directly when using blueprints.
+
+        Keyword Arguments:
+            cert_urls {list} -- certificate chain URLs to fetch right away (default: {()})
+            lead_time {int} -- seconds before expiry to refresh a certificate (default: {3600})
+            interval {int} -- seconds between refresh passes (default: {60})
+        """
+        if self.cert_refresher is None:
+            self.cert_refresher = verifier.CertificateRefresher(self.cert_cache, lead_time, interval)
+        for cert_url in cert_urls:
+            self.cert_refresher.track(cert_url)
+        self.cert_refresher.start()
+
+    def reload_templates(self):
+        """Re-read the templates yaml file.
+
+        Templates compiled from the previous version are recompiled on their next use, whether
+        or not Jinja's auto_reload is on. This is the only way the file is reloaded when
+        `ASK_TEMPLATE_RELOAD_INTERVAL` is 0, e.g. from a SIGHUP handler.
+        """
+        if self._template_loader is not None:
+            self._template_loader.reload()
+
+    def warm_up(self, app=None, launch=False):
+        """Do ahead of time the work that would otherwise slow down the first request.
+
+        Compiles every template in the templates yaml file, runs each slot converter
+        once, loads the JSON backend and, unless `ASK_VERIFY_REQUESTS` is off,
+        imports the signature checking libraries and fetches the certificates listed in
+        `ASK_CERT_URLS` into the cert_cache.
+
+        init_app calls this when `ASK_WARM_UP` is set. Call it directly after the view
+        functions are registered to also dispatch a synthetic LaunchRequest, e.g. at the
+        end of a skill module loaded with gunicorn --preload, so that forked workers share
+        the warmed state copy-on-write.
+
+        Keyword Arguments:
+            app {Flask} -- app to warm up, required when using blueprints (default: {the app given to init_app})
+            launch {bool} -- dispatch a synthetic LaunchRequest to the launch view, without verification.
+                Its session is not new, so on_session_started is not called. Its response is
+                discarded, along with any streams it stores. Errors it raises are logged as
+                warnings. (default: {False})
+        """
+        app = app or self.app
+        if app is None:
+            raise TypeError("app is a required argument when using blueprints")
+
+        if self._template_loader is not None:
+            for template in list(self._template_loader.mapping or ()):
+                app.jinja_env.get_template(template)
+
+        for name, convert in _converters.items():
+            convert(_converter_samples[name])
+
+        get_backend(app.config.get('ASK_JSON_BACKEND', 'flask'))
+        if app.config.get('ASK_VERIFY_REQUESTS', True):
+            verifier.warm_up(app.config.get('ASK_CERT_URLS', []), self.cert_cache)
+
+        if launch and 'LaunchRequest' in self._request_handlers:
+            try:
+                self._run_aws_lambda_direct(_warm_up_event('LaunchRequest'), app)
+            except Exception as e:
+                logger.warning("Warm-up LaunchRequest failed: {}".format(e))
+            finally:
+                self.stream_cache.delete(_WARM_UP_USER_ID)
 
     @property
     def ask_verify_requests(self):
@@ -174,6 +477,22 @@ class Ask(object):
     def ask_application_id(self):
         return current_app.config.get('ASK_APPLICATION_ID', None)
 
+    @property
+    def ask_verify_replay(self):
+        return current_app.config.get('ASK_VERIFY_REPLAY', False)
+
+    @property
+    def ask_typed_models(self):
+        return current_app.config.get('ASK_TYPED_MODELS', False)
+
+    @property
+    def ask_stream_max_depth(self):
+        return current_app.config.get('ASK_STREAM_MAX_DEPTH')
+
+    @property
+    def ask_stream_records(self):
+        return current_app.config.get('ASK_STREAM_RECORDS', False)
+
     def on_session_started(self, f):
         """Decorator to call wrapped function upon starting a session.
 
@@ -204,7 +523,7 @@ class Ask(object):
         Arguments:
             f {function} -- Launch view function
         """
-        self._launch_view_func = f
+        self._request_handlers['LaunchRequest'] = f
 
         @wraps(f)
         def wrapper(*args, **kw):
@@ -224,7 +543,7 @@ class Ask(object):
         Arguments:
             f {function} -- session_ended view function
         """
-        self._session_ended_view_func = f
+        self._request_handlers['SessionEndedRequest'] = f
 
         @wraps(f)
         def wrapper(*args, **kw):
@@ -256,10 +575,7 @@ class Ask(object):
                 default: {}
         """
         def decorator(f):
-            self._intent_view_funcs[intent_name] = f
-            self._intent_mappings[intent_name] = mapping
-            self._intent_converts[intent_name] = convert
-            self._intent_defaults[intent_name] = default
+            self._register_view(intent_name, f, mapping, convert, default)
 
             @wraps(f)
             def wrapper(*args, **kw):
@@ -269,7 +585,7 @@ class Ask(object):
 
     def default_intent(self, f):
         """Decorator routes any Alexa IntentRequest that is not matched by any existing @ask.intent routing."""
-        self._default_intent_view_func = f
+        self._default_intent_binder = _ViewBinder(f)
 
         @wraps(f)
         def wrapper(*args, **kw):
@@ -289,7 +605,7 @@ class Ask(object):
         Arguments:
             f {function} -- display_element_selected view function
         """
-        self._display_element_selected_func = f
+        self._request_handlers['Display.ElementSelected'] = f
 
         @wraps(f)
         def wrapper(*args, **kw):
@@ -297,6 +613,41 @@ class Ask(object):
         return f
 
 
+    def on_request(self, request_type, mapping={}, convert={}, default={}):
+        """Decorator routes any Alexa request type to the wrapped function.
+
+        Use it for request types Flask-Ask has no dedicated decorator for. Parameters of the
+        wrapped function are filled from the intent's slots if the request has an intent,
+        and from the fields of the request otherwise, as with on_playback_started.
+
+        @ask.on_request('CanFulfillIntentRequest', mapping={'city': 'City'})
+        def can_fulfill(city):
+            ...
+
+        @ask.on_request('Alexa.Presentation.APL.UserEvent')
+        def user_event(arguments, source):
+            ...
+
+        Arguments:
+            request_type {str} -- Exact value of request.type to be mapped to the decorated function
+
+        Keyword Arguments:
+            mapping {dict} -- Maps parameters to slots or request fields of a different name
+                default: {}
+
+            convert {dict} -- Converts request field values to data types before assignment to parameters
+                default: {}
+
+            default {dict} --  Provides default values for parameters whose slot or field is missing or empty
+                default: {}
+        """
+        def decorator(f):
+            self._request_handlers[request_type] = partial(self._dispatch_view,
+                                                           _ViewBinder(f, mapping, convert, default))
+            return f
+        return decorator
+
+
     def on_purchase_completed(self, mapping={'payload': 'payload','name':'name','status':'status','token':'token'}, convert={}, default={}):
         """Decorator routes an Connections.Response  to the wrapped function.
 
@@ -316,16 +667,7 @@ class Ask(object):
             logger.info(token)
             
         """
-        def decorator(f):
-            self._intent_view_funcs['Connections.Response'] = f
-            self._intent_mappings['Connections.Response'] = mapping
-            self._intent_converts['Connections.Response'] = convert
-            self._intent_defaults['Connections.Response'] = default
-            @wraps(f)
-            def wrapper(*args, **kwargs):
-                self._flask_view_func(*args, **kwargs)
-            return f
-        return decorator
+        return self.on_request('Connections.Response', mapping, convert, default)
 
 
     def on_playback_started(self, mapping={'offset': 'offsetInMilliseconds'}, convert={}, default={}):
@@ -349,17 +691,7 @@ class Ask(object):
             logger.info('stream has token {}'.format(token))
             logger.info('Current position within the stream is {} ms'.format(offset))
         """
-        def decorator(f):
-            self._intent_view_funcs['AudioPlayer.PlaybackStarted'] = f
-            self._intent_mappings['AudioPlayer.PlaybackStarted'] = mapping
-            self._intent_converts['AudioPlayer.PlaybackStarted'] = convert
-            self._intent_defaults['AudioPlayer.PlaybackStarted'] = default
-
-            @wraps(f)
-            def wrapper(*args, **kwargs):
-                self._flask_view_func(*args, **kwargs)
-            return f
-        return decorator
+        return self.on_request('AudioPlayer.PlaybackStarted', mapping, convert, default)
 
     def on_playback_finished(self, mapping={'offset': 'offsetInMilliseconds'}, convert={}, default={}):
         """Decorator routes an AudioPlayer.PlaybackFinished Request to the wrapped function.
@@ -380,17 +712,7 @@ class Ask(object):
 
         Audioplayer Requests do not include the stream URL, it must be accessed from current_stream.url
         """
-        def decorator(f):
-            self._intent_view_funcs['AudioPlayer.PlaybackFinished'] = f
-            self._intent_mappings['AudioPlayer.PlaybackFinished'] = mapping
-            self._intent_converts['AudioPlayer.PlaybackFinished'] = convert
-            self._intent_defaults['AudioPlayer.PlaybackFinished'] = default
-
-            @wraps(f)
-            def wrapper(*args, **kwargs):
-                self._flask_view_func(*args, **kwargs)
-            return f
-        return decorator
+        return self.on_request('AudioPlayer.PlaybackFinished', mapping, convert, default)
 
     def on_playback_stopped(self, mapping={'offset': 'offsetInMilliseconds'}, convert={}, default={}):
         """Decorator routes an AudioPlayer.PlaybackStopped Request to the wrapped function.
@@ -418,17 +740,7 @@ class Ask(object):
 
         Audioplayer Requests do not include the stream URL, it must be accessed from current_stream.url
         """
-        def decorator(f):
-            self._intent_view_funcs['AudioPlayer.PlaybackStopped'] = f
-            self._intent_mappings['AudioPlayer.PlaybackStopped'] = mapping
-            self._intent_converts['AudioPlayer.PlaybackStopped'] = convert
-            self._intent_defaults['AudioPlayer.PlaybackStopped'] = default
-
-            @wraps(f)
-            def wrapper(*args, **kwargs):
-                self._flask_view_func(*args, **kwargs)
-            return f
-        return decorator
+        return self.on_request('AudioPlayer.PlaybackStopped', mapping, convert, default)
 
     def on_playback_nearly_finished(self, mapping={'offset': 'offsetInMilliseconds'}, convert={}, default={}):
         """Decorator routes an AudioPlayer.PlaybackNearlyFinished Request to the wrapped function.
@@ -473,17 +785,7 @@ class Ask(object):
             _infodump('Stream at {} ms when Playback Request sent'.format(pos))
             _infodump('Stream holds the token {}'.format(stream_token))
         """
-        def decorator(f):
-            self._intent_view_funcs['AudioPlayer.PlaybackNearlyFinished'] = f
-            self._intent_mappings['AudioPlayer.PlaybackNearlyFinished'] = mapping
-            self._intent_converts['AudioPlayer.PlaybackNearlyFinished'] = convert
-            self._intent_defaults['AudioPlayer.PlaybackNearlyFinished'] = default
-
-            @wraps(f)
-            def wrapper(*args, **kwargs):
-                self._flask_view_func(*args, **kwargs)
-            return f
-        return decorator
+        return self.on_request('AudioPlayer.PlaybackNearlyFinished', mapping, convert, default)
 
     def on_playback_failed(self, mapping={}, convert={}, default={}):
         """Decorator routes an AudioPlayer.PlaybackFailed Request to the wrapped function.
@@ -510,17 +812,7 @@ class Ask(object):
 
                     playerActivity - player state when the error occurred
         """
-        def decorator(f):
-            self._intent_view_funcs['AudioPlayer.PlaybackFailed'] = f
-            self._intent_mappings['AudioPlayer.PlaybackFailed'] = mapping
-            self._intent_converts['AudioPlayer.PlaybackFailed'] = convert
-            self._intent_defaults['AudioPlayer.PlaybackFailed'] = default
-
-            @wraps(f)
-            def wrapper(*args, **kwargs):
-                self._flask_view_func(*args, **kwargs)
-            return f
-        return decorator
+        return self.on_request('AudioPlayer.PlaybackFailed', mapping, convert, default)
 
     @property
     def request(self):
@@ -564,10 +856,13 @@ class Ask(object):
 
     @property
     def current_stream(self):
-        #return getattr(_app_ctx_stack.top, '_ask_current_stream', models._Field())
         user = self._get_user()
         if user:
-            stream = top_stream(self.stream_cache, user)
+            work = self._stream_work(user)
+            if work is None:
+                stream = top_stream(self.stream_cache, user)
+            else:
+                stream = work.top()
             if stream:
                 current = models._Field()
                 current.__dict__.update(stream)
@@ -580,9 +875,73 @@ class Ask(object):
         # assumption 2 is if someone sets a value, it's resetting the stack
         user = self._get_user()
         if user:
-            set_stream(self.stream_cache, user, value.__dict__)
-
-    def run_aws_lambda(self, event):
+            work = self._stream_work(user)
+            if work is None:
+                set_stream(self.stream_cache, user, value.__dict__, compact=self._stream_options()[1])
+            else:
+                work.set(dict(value.__dict__))
+
+    def _push_stream(self, user, stream):
+        """Pushes stream onto the user's stack, written to stream_cache when the request ends."""
+        work = self._stream_work(user)
+        if work is None:
+            max_depth, compact = self._stream_options()
+            return push_stream(self.stream_cache, user, stream, max_depth=max_depth, compact=compact)
+        return work.push(stream)
+
+    def _stream_options(self):
+        """Returns ASK_STREAM_MAX_DEPTH and ASK_STREAM_RECORDS, or their defaults outside an app context."""
+        if _app_ctx_stack.top is None:
+            return None, False
+        return self.ask_stream_max_depth, self.ask_stream_records
+
+    def _stream_work(self, user):
+        """Returns the unit of work for the user's stream stack in this app context.
+
+        Returns None when changes cannot be deferred: outside an app context, before
+        the app has registered the teardown that commits them, or when another Ask
+        instance already holds the stream state of this app context.
+        """
+        ctx = _app_ctx_stack.top
+        if ctx is None or not self._buffer_streams:
+            return None
+        state = getattr(ctx, '_ask_stream_state', None)
+        if state is None:
+            state = ctx._ask_stream_state = _StreamState(self)
+        elif state.ask is not self:
+            return None
+        work = state.works.get(user)
+        if work is None:
+            max_depth, compact = self._stream_options()
+            work = state.works[user] = StreamUnitOfWork(self.stream_cache, user,
+                                                        max_depth=max_depth, compact=compact)
+        return work
+
+    def _register_stream_teardown(self, app):
+        app.teardown_appcontext(self._flush_streams)
+        self._buffer_streams = True
+
+    def _flush_streams(self, exc=None):
+        """Commits the stream changes made during the request to stream_cache.
+
+        _flask_view_func calls this when each request ends, since Flask reuses an app
+        context that is already pushed. The app context teardown covers
+        run_aws_lambda(direct=True) and anything else done in an app context of its own.
+        Nothing is written if the request failed, so a half-handled request leaves the
+        cached streams as they were.
+        """
+        ctx = _app_ctx_stack.top
+        state = getattr(ctx, '_ask_stream_state', None)
+        if state is None or state.ask is not self:
+            return
+        del ctx._ask_stream_state
+        if exc is not None:
+            return
+        for work in state.works.values():
+            if not work.commit():
+                logger.warning('Could not store the audio stream of user {}'.format(work.user_id))
+
+    def run_aws_lambda(self, event, direct=False):
         """Invoke the Flask Ask application from an AWS Lambda function handler.
 
         Use this method to service AWS Lambda requests from a custom Alexa
@@ -610,46 +969,29 @@ class Ask(object):
             def hello(firstname):
                 speech_text = "Hello %s" % firstname
                 return statement(speech_text).simple_card('Hello', speech_text)
-        """
 
-        # We are guaranteed to be called by AWS as a Lambda function does not
-        # expose a public facing interface.
-        self.app.config['ASK_VERIFY_REQUESTS'] = False
+        With direct=True the event is dispatched to the view functions under an
+        app context, without building a WSGI request, and the response is
+        returned without ever being serialized to JSON. Flask's request hooks
+        and error handlers do not run on this path, and exceptions raised by
+        view functions propagate to the Lambda handler.
 
-        # Convert an environment variable to a WSGI "bytes-as-unicode" string
-        enc, esc = sys.getfilesystemencoding(), 'surrogateescape'
-        def unicode_to_wsgi(u):
-            return u.encode(enc, esc).decode('iso-8859-1')
+        Arguments:
+            event {dict} -- Alexa request event passed to the Lambda handler
 
-        # Create a WSGI-compatible environ that can be passed to the
-        # application. It is loaded with the OS environment variables,
-        # mandatory CGI-like variables, as well as the mandatory WSGI
-        # variables.
-        environ = {k: unicode_to_wsgi(v) for k, v in os.environ.items()}
-        environ['REQUEST_METHOD'] = 'POST'
-        environ['PATH_INFO'] = '/'
-        environ['SERVER_NAME'] = 'AWS-Lambda'
-        environ['SERVER_PORT'] = '80'
-        environ['SERVER_PROTOCOL'] = 'HTTP/1.0'
-        environ['wsgi.version'] = (1, 0)
-        environ['wsgi.url_scheme'] = 'http'
-        environ['wsgi.errors'] = sys.stderr
-        environ['wsgi.multithread'] = False
-        environ['wsgi.multiprocess'] = False
-        environ['wsgi.run_once'] = True
+        Keyword Arguments:
+            direct {bool} -- bypass WSGI and dispatch the event dict directly (default: {False})
+        """
+        if direct:
+            return self._run_aws_lambda_direct(event)
 
-        # Convert the event provided by the AWS Lambda handler to a JSON
-        # string that can be read as the body of a HTTP POST request.
-        body = json.dumps(event)
-        environ['CONTENT_TYPE'] = 'application/json'
-        environ['CONTENT_LENGTH'] = len(body)
-        
-        PY3 = sys.version_info[0] == 3
-        
-        if PY3:
-            environ['wsgi.input'] = io.StringIO(body)
-        else:
-            environ['wsgi.input'] = io.BytesIO(body)
+        # Copy the static part of the environ and add the event provided by
+        # the AWS Lambda handler, serialized as the body of a HTTP POST request.
+        environ = dict(self._lambda_environ())
+        backend = get_backend(self.app.config.get('ASK_JSON_BACKEND', 'flask'))
+        body = backend.dumps(event).encode('utf-8')
+        environ['CONTENT_LENGTH'] = str(len(body))
+        environ['wsgi.input'] = io.BytesIO(body)
 
         # Start response is a required callback that must be passed when
         # the application is invoked. It is used to set HTTP status and
@@ -674,7 +1016,7 @@ class Ask(object):
             # The Lambda handler expects a Python object that can be
             # serialized as JSON, so we need to take the already serialized
             # JSON and deserialize it.
-            return json.loads(output)
+            return backend.loads(output)
 
         finally:
             # Per the WSGI spec, we need to invoke the close method if it
@@ -683,6 +1025,57 @@ class Ask(object):
                 result.close()
 
 
+    def _lambda_environ(self):
+        """The part of run_aws_lambda's WSGI environ that is the same for every
+        invocation, built on the first one and kept for the life of the container."""
+        if self._lambda_environ_template is not None:
+            return self._lambda_environ_template
+
+        # We are guaranteed to be called by AWS as a Lambda function does not
+        # expose a public facing interface.
+        self.app.config['ASK_VERIFY_REQUESTS'] = False
+
+        # Convert an environment variable to a WSGI "bytes-as-unicode" string
+        enc, esc = sys.getfilesystemencoding(), 'surrogateescape'
+        def unicode_to_wsgi(u):
+            return u.encode(enc, esc).decode('iso-8859-1')
+
+        # Create a WSGI-compatible environ that can be passed to the
+        # application. It is loaded with the OS environment variables,
+        # mandatory CGI-like variables, as well as the mandatory WSGI
+        # variables.
+        environ = {k: unicode_to_wsgi(v) for k, v in os.environ.items()}
+        environ['REQUEST_METHOD'] = 'POST'
+        environ['PATH_INFO'] = '/'
+        environ['SERVER_NAME'] = 'AWS-Lambda'
+        environ['SERVER_PORT'] = '80'
+        environ['SERVER_PROTOCOL'] = 'HTTP/1.0'
+        environ['CONTENT_TYPE'] = 'application/json'
+        environ['wsgi.version'] = (1, 0)
+        environ['wsgi.url_scheme'] = 'http'
+        environ['wsgi.errors'] = sys.stderr
+        environ['wsgi.multithread'] = False
+        environ['wsgi.multiprocess'] = False
+        environ['wsgi.run_once'] = True
+
+        self._lambda_environ_template = environ
+        return environ
+
+    def _run_aws_lambda_direct(self, event, app=None):
+        with (app or self.app).app_context():
+            # the event comes from AWS, not from a public endpoint
+            _app_ctx_stack.top._ask = self
+            result = self._dispatch_payload(event)
+            if isinstance(result, models._Response):
+                return result.render_dict()
+
+            # anything else a view may return, e.g. the "{}" answering SessionEndedRequest
+            response = current_app.make_response(result if result is not None else ("", 400))
+            if response.status_code // 100 != 2:
+                raise AssertionError("Non-2xx from app: status={}, body={}".format(
+                    response.status, response.get_data()))
+            return json_backend().loads(response.get_data())
+
     def _get_user(self):
         if self.context:
             return self.context.get('System', {}).get('user', {}).get('userId')
@@ -691,14 +1084,17 @@ class Ask(object):
 
     def _alexa_request(self, verify=True):
         raw_body = flask_request.data
-        alexa_request_payload = json.loads(raw_body)
+        alexa_request_payload = json_backend().loads(raw_body)
 
         if verify:
             cert_url = flask_request.headers['Signaturecertchainurl']
             signature = flask_request.headers['Signature']
 
             # load certificate - this verifies a the certificate url and format under the hood
-            cert = verifier.load_certificate(cert_url)
+            # only the first request for a given chain url fetches it, later ones hit the cache
+            cert = verifier.load_certificate(cert_url, cache=self.cert_cache)
+            if self.cert_refresher is not None:
+                self.cert_refresher.track(cert_url)
             # verify signature
             verifier.verify_signature(cert, signature, raw_body)
 
@@ -718,6 +1114,11 @@ class Ask(object):
             if self.ask_application_id is not None:
                 verifier.verify_application_id(application_id, self.ask_application_id)
 
+            # verify request id has not been seen before
+            if self.ask_verify_replay:
+                request_id = alexa_request_payload.get('request', {}).get('requestId')
+                verifier.verify_request_id(request_id, self.replay_cache)
+
         return alexa_request_payload
 
     @staticmethod
@@ -726,6 +1127,7 @@ class Ask(object):
         Parse a given timestamp value, raising ValueError if None or Flasey
         """
         if timestamp:
+            import aniso8601
             try:
                 return aniso8601.parse_datetime(timestamp)
             except AttributeError:
@@ -750,13 +1152,18 @@ class Ask(object):
             fresh_stream.__dict__.update(context_info)
 
         self.current_stream = fresh_stream
-        dbgdump(current_stream.__dict__)
+        dbgdump(fresh_stream.__dict__, event='stream')
 
     def _from_context(self):
         return getattr(self.context, 'AudioPlayer', {})
 
     def _from_directive(self):
-        from_buffer = top_stream(self.stream_cache, self._get_user())
+        user = self._get_user()
+        work = self._stream_work(user) if user else None
+        if work is None:
+            from_buffer = top_stream(self.stream_cache, user)
+        else:
+            from_buffer = work.top()
         if from_buffer:
             if self.request.intent and 'PauseIntent' in self.request.intent.name:
                 return {}
@@ -764,9 +1171,36 @@ class Ask(object):
         return {}
 
     def _flask_view_func(self, *args, **kwargs):
+        _app_ctx_stack.top._ask = self
+        try:
+            response = self._flask_response()
+        except Exception as e:
+            self._flush_streams(e)
+            raise
+        self._flush_streams()
+        return response
+
+    def _flask_response(self):
         ask_payload = self._alexa_request(verify=self.ask_verify_requests)
-        dbgdump(ask_payload)
-        request_body = models._Field(ask_payload)
+        result = self._dispatch_payload(ask_payload)
+
+        if result is not None:
+            if isinstance(result, models._Response):
+                return result.render_response()
+            return result
+        return "", 400
+
+    def _dispatch_payload(self, ask_payload):
+        """Sets up the request state from a parsed payload and runs its handler.
+
+        Returns whatever the handler returned, or None if no handler is registered
+        for the request type.
+        """
+        dbgdump(ask_payload, event='request')
+        if self.ask_typed_models:
+            request_body = models.RequestBody(ask_payload)
+        else:
+            request_body = models._Field(ask_payload)
 
         self.request = request_body.request
         self.version = request_body.version
@@ -792,78 +1226,29 @@ class Ask(object):
         except AttributeError:
             pass
 
-        result = None
-        request_type = self.request.type
+        handler = self._request_handlers.get(self.request.type)
+        return handler() if handler is not None else None
 
-        if request_type == 'LaunchRequest' and self._launch_view_func:
-            result = self._launch_view_func()
-        elif request_type == 'SessionEndedRequest':
-            if self._session_ended_view_func:
-                result = self._session_ended_view_func()
-            else:
-                result = "{}", 200
-        elif request_type == 'IntentRequest' and ( self._intent_view_funcs or self._default_intent_view_func is not None ):
-            result = self._map_intent_to_view_func(self.request.intent)()
-        elif request_type == 'Display.ElementSelected' and self._display_element_selected_func:
-            result = self._display_element_selected_func()
-        elif 'AudioPlayer' in request_type:
-            result = self._map_player_request_to_func(self.request.type)()
-            # routes to on_playback funcs
-            # user can also access state of content.AudioPlayer with current_stream
-        elif 'Connections.Response' in request_type:
-            result = self._map_purchase_request_to_func(self.request.type)()
+    def _register_view(self, name, view_func, mapping, convert, default):
+        self._view_binders[name] = _ViewBinder(view_func, mapping, convert, default)
 
-        if result is not None:
-            if isinstance(result, models._Response):
-                return result.render_response()
-            return result
-        return "", 400
+    def _dispatch_intent(self):
+        if not self._view_binders and self._default_intent_binder is None:
+            return None
+        return self._map_intent_to_view_func(self.request.intent)()
+
+    def _dispatch_view(self, binder):
+        return self._bind_view(binder)()
 
     def _map_intent_to_view_func(self, intent):
         """Provides appropiate parameters to the intent functions."""
-        if intent.name in self._intent_view_funcs:
-            view_func = self._intent_view_funcs[intent.name]
-        elif self._default_intent_view_func is not None:
-            view_func = self._default_intent_view_func
+        if intent.name in self._view_binders:
+            binder = self._view_binders[intent.name]
+        elif self._default_intent_binder is not None:
+            binder = self._default_intent_binder
         else:
             raise NotImplementedError('Intent "{}" not found and no default intent specified.'.format(intent.name))
-
-        PY3 = sys.version_info[0] == 3
-        if PY3:
-            argspec = inspect.getfullargspec(view_func)
-        else:
-            argspec = inspect.getargspec(view_func)
-            
-        arg_names = argspec.args
-        arg_values = self._map_params_to_view_args(intent.name, arg_names)
-
-        return partial(view_func, *arg_values)
-
-    def _map_player_request_to_func(self, player_request_type):
-        """Provides appropriate parameters to the on_playback functions."""
-        # calbacks for on_playback requests are optional
-        view_func = self._intent_view_funcs.get(player_request_type, lambda: None)
-
-        argspec = inspect.getargspec(view_func)
-        arg_names = argspec.args
-        arg_values = self._map_params_to_view_args(player_request_type, arg_names)
-
-        return partial(view_func, *arg_values)
-
-    def _map_purchase_request_to_func(self, purchase_request_type):
-        """Provides appropriate parameters to the on_purchase functions."""
-        
-        if purchase_request_type in self._intent_view_funcs:
-            view_func = self._intent_view_funcs[purchase_request_type]
-        else:
-            raise NotImplementedError('Request type "{}" not found and no default view specified.'.format(purchase_request_type)) 
-
-        argspec = inspect.getargspec(view_func)
-        arg_names = argspec.args
-        arg_values = self._map_params_to_view_args(purchase_request_type, arg_names)
-
-        print('_map_purchase_request_to_func', arg_names, arg_values, view_func, purchase_request_type)
-        return partial(view_func, *arg_values)
+        return self._bind_view(binder)
 
     def _get_slot_value(self, slot_object):
         slot_name = slot_object.name
@@ -881,15 +1266,14 @@ class Ask(object):
 
         return slot_value
 
-    def _map_params_to_view_args(self, view_name, arg_names):
-
-        arg_values = []
-        convert = self._intent_converts.get(view_name)
-        default = self._intent_defaults.get(view_name)
-        mapping = self._intent_mappings.get(view_name)
-
-        convert_errors = {}
+    def _bind_view(self, binder):
+        if not binder.params:
+            self.convert_errors = {}
+            return binder.view_func
+        view_func, self.convert_errors = binder.bind(self._request_data())
+        return view_func
 
+    def _request_data(self):
         request_data = {}
         intent = getattr(self.request, 'intent', None)
         if intent is not None:
@@ -901,46 +1285,80 @@ class Ask(object):
         else:
             for param_name in self.request:
                 request_data[param_name] = getattr(self.request, param_name, None)
-
-        for arg_name in arg_names:
-            param_or_slot = mapping.get(arg_name, arg_name)
-            arg_value = request_data.get(param_or_slot)
-            if arg_value is None or arg_value == "":
-                if arg_name in default:
-                    default_value = default[arg_name]
-                    if isinstance(default_value, collections.Callable):
-                        default_value = default_value()
-                    arg_value = default_value
-            elif arg_name in convert:
-                shorthand_or_function = convert[arg_name]
-                if shorthand_or_function in _converters:
-                    shorthand = shorthand_or_function
-                    convert_func = _converters[shorthand]
-                else:
-                    convert_func = shorthand_or_function
-                try:
-                    arg_value = convert_func(arg_value)
-                except Exception as e:
-                    convert_errors[arg_name] = e
-            arg_values.append(arg_value)
-        self.convert_errors = convert_errors
-        return arg_values
+        return request_data
 
 
 class YamlLoader(BaseLoader):
+    """Jinja loader for the templates in a skill's yaml file.
+
+    With reload_interval None, the file is checked for changes on every lookup.
+    Otherwise it is checked at most once every reload_interval seconds, or with 0
+    only when reload is called, and compiled templates are kept until the file
+    version they came from is replaced.
+
+    Jinja only consults the loader about templates it has already compiled when
+    its auto_reload is on (Flask's TEMPLATES_AUTO_RELOAD, on in debug mode). With
+    it off, the interval check only runs when some template is not yet compiled,
+    but whenever the file is re-read, including by reload, the compiled templates
+    of every environment that loaded from it are dropped.
+    """
 
-    def __init__(self, app, path):
+    def __init__(self, app, path, reload_interval=None):
         self.path = app.root_path + os.path.sep + path
         self.mapping = {}
+        self.reload_interval = reload_interval
+        self.version = 0
+        self._next_check = 0
+        self._environments = weakref.WeakSet()
         self._reload_mapping()
 
     def _reload_mapping(self):
         if os.path.isfile(self.path):
             self.last_mtime = os.path.getmtime(self.path)
+            import yaml
             with open(self.path) as f:
+                old_names = set(self.mapping or ())
                 self.mapping = yaml.safe_load(f.read())
+            self.version += 1
+            self._forget_compiled(old_names | set(self.mapping or ()))
+
+    def _forget_compiled(self, names):
+        for environment in list(self._environments):
+            cache = environment.cache
+            if not cache:
+                continue
+            # cache keys are (weakref to the environment's loader, template name)
+            for key in list(cache.keys()):
+                if key[1] in names:
+                    try:
+                        del cache[key]
+                    except KeyError:
+                        pass
+
+    def reload(self):
+        """Re-read the templates file, marking templates compiled from the old one out of date."""
+        self._next_check = time.time() + (self.reload_interval or 0)
+        self._reload_mapping()
+
+    def _check_file(self):
+        if not self.reload_interval or time.time() < self._next_check:
+            return
+        self._next_check = time.time() + self.reload_interval
+        if os.path.isfile(self.path) and self.last_mtime != os.path.getmtime(self.path):
+            self._reload_mapping()
+
+    def _uptodate(self, version):
+        self._check_file()
+        return version == self.version
 
     def get_source(self, environment, template):
+        self._environments.add(environment)
+        if self.reload_interval is not None:
+            self._check_file()
+            if template in self.mapping:
+                return self.mapping[template], None, partial(self._uptodate, self.version)
+            raise TemplateNotFound(template)
+
         if not os.path.isfile(self.path):
             return None, None, None
         if self.last_mtime != os.path.getmtime(self.path):
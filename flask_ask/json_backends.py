@@ -0,0 +1,116 @@
+"""
+JSON backends for parsing Alexa requests and rendering responses
+"""
+import json
+
+import six
+from flask import json as flask_json
+
+from . import logger
+
+
+class FlaskJSON(object):
+    """Flask's json module, which honors the app's json_encoder and json_decoder."""
+
+    def loads(self, s):
+        return flask_json.loads(s)
+
+    def dumps(self, obj, default=None, cls=None, indent=None):
+        # flask.json fills in the app's encoder with setdefault, so pass only what was given
+        kwargs = {}
+        if default is not None:
+            kwargs['default'] = default
+        if cls is not None:
+            kwargs['cls'] = cls
+        if indent is not None:
+            kwargs['indent'] = indent
+        return flask_json.dumps(obj, **kwargs)
+
+
+class StdlibJSON(object):
+    """The standard library json module, without Flask's encoder hooks."""
+
+    def loads(self, s):
+        if isinstance(s, bytes):
+            s = s.decode('utf-8')
+        return json.loads(s)
+
+    def dumps(self, obj, default=None, cls=None, indent=None):
+        return json.dumps(obj, default=default, cls=cls, indent=indent)
+
+
+class UltraJSON(StdlibJSON):
+    """ujson, falling back to the standard library when given an encoder class."""
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, s):
+        return self._ujson.loads(s)
+
+    def dumps(self, obj, default=None, cls=None, indent=None):
+        if cls is not None:
+            return super(UltraJSON, self).dumps(obj, default=default, cls=cls, indent=indent)
+        return self._ujson.dumps(obj, default=default, indent=indent or 0, escape_forward_slashes=False)
+
+
+class OrJSON(StdlibJSON):
+    """orjson, falling back to the standard library when given an encoder class."""
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, s):
+        return self._orjson.loads(s)
+
+    def dumps(self, obj, default=None, cls=None, indent=None):
+        if cls is not None:
+            return super(OrJSON, self).dumps(obj, default=default, cls=cls, indent=indent)
+        option = self._orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= self._orjson.OPT_INDENT_2
+        return self._orjson.dumps(obj, default=default, option=option).decode('utf-8')
+
+
+_backend_classes = {
+    'flask': FlaskJSON,
+    'json': StdlibJSON,
+    'ujson': UltraJSON,
+    'orjson': OrJSON,
+}
+
+_backends = {}
+
+
+def get_backend(name='flask'):
+    """
+    Look up a JSON backend by name.
+
+    :param name: one of 'flask', 'json', 'ujson' or 'orjson', 'auto' for the
+                 fastest one installed, or an object with loads and dumps methods
+
+    :return: backend with loads(s) and dumps(obj, default=None, cls=None, indent=None)
+    """
+    if not isinstance(name, six.string_types):
+        return name
+    try:
+        return _backends[name]
+    except KeyError:
+        pass
+    candidates = ['orjson', 'ujson', 'json'] if name == 'auto' else [name]
+    for candidate in candidates:
+        try:
+            backend = _backend_classes[candidate]()
+            break
+        except ImportError:
+            continue
+        except KeyError:
+            raise ValueError('Unknown ASK_JSON_BACKEND "{}"'.format(name))
+    else:
+        logger.warning('JSON backend "{}" is not installed, using the standard library'.format(name))
+        backend = StdlibJSON()
+    _backends[name] = backend
+    return backend
+
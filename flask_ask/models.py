@@ -1,9 +1,6 @@
 import inspect
-from flask import json
 from xml.etree import ElementTree
-import aniso8601
-from .core import session, context, current_stream, stream_cache, dbgdump
-from .cache import push_stream
+from .core import session, context, current_stream, _current_ask, dbgdump, json_backend
 import uuid
 
 
@@ -14,7 +11,7 @@ class _Field(dict):
     to be accessed via dot notation or as a dict key-value.
 
     Parameters within the request_json that contain their data as a json object
-    are also represented as a _Field object.
+    are also represented as a _Field object, created when they are first accessed.
 
     Example:
 
@@ -26,22 +23,205 @@ class _Field(dict):
     assert request_type_from_keys == request_type_from_attrs
     """
 
+    # _derived holds attribute values computed from items, such as parsed timestamps
+    __slots__ = ('__dict__', '_derived')
+
     def __init__(self, request_json={}):
+        # nested dicts are wrapped on first access rather than up front,
+        # as most handlers only look at a small part of the payload
         super(_Field, self).__init__(request_json)
-        for key, value in request_json.items():
-            if isinstance(value, dict):
-                value = _Field(value)
-            self[key] = value
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, dict) and not isinstance(value, _Field):
+            value = _Field(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        value = dict.pop(self, key, *default)
+        if isinstance(value, dict) and not isinstance(value, _Field):
+            value = _Field(value)
+        return value
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
 
     def __getattr__(self, attr):
-        # converts timestamp str to datetime.datetime object
-        if 'timestamp' in attr:
-            return aniso8601.parse_datetime(self.get(attr))
-        return self.get(attr)
+        # special names must raise, or copy and pickle find None for __setstate__ and friends
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        if 'timestamp' not in attr:
+            return self.get(attr)
+
+        # converts timestamp str to datetime.datetime object, once per value
+        try:
+            derived = object.__getattribute__(self, '_derived')
+        except AttributeError:
+            derived = {}
+            object.__setattr__(self, '_derived', derived)
+        raw = self.get(attr)
+        cached = derived.get(attr)
+        if cached is not None and cached[0] is raw:
+            return cached[1]
+        import aniso8601
+        value = aniso8601.parse_datetime(raw)
+        derived[attr] = (raw, value)
+        return value
 
     def __setattr__(self, key, value):
         self.__setitem__(key, value)
 
+    def __getstate__(self):
+        # the items are pickled as dict items; _derived is only a cache and is left out
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class _Model(object):
+    """Typed, slotted view over one object of the Alexa request payload.
+
+    The fields named in ``_fields`` are read from the payload once, when the
+    model is built, and stored in slots; fields listed in ``_types`` are
+    converted to their model class on the way. Any other key falls back to
+    the raw payload, with nested dicts wrapped in _Field on first access, for
+    both attribute and item access.
+
+    Used in place of _Field when ASK_TYPED_MODELS is set.
+    """
+
+    __slots__ = ('_raw',)
+    _fields = ()
+    _types = {}
+
+    def __init__(self, raw):
+        raw = dict(raw)
+        object.__setattr__(self, '_raw', raw)
+        for name in self._fields:
+            value = raw.get(name)
+            if value is not None:
+                if name in self._types:
+                    value = raw[name] = self._types[name](value)
+                elif isinstance(value, dict) and not isinstance(value, _Field):
+                    value = raw[name] = _Field(value)
+            object.__setattr__(self, name, value)
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return self.get(attr)
+
+    def __setattr__(self, attr, value):
+        if attr in self._fields:
+            object.__setattr__(self, attr, value)
+        self._raw[attr] = value
+
+    def __getitem__(self, key):
+        value = self._raw[key]
+        if isinstance(value, dict) and not isinstance(value, _Field):
+            value = self._raw[key] = _Field(value)
+        return value
+
+    def __setitem__(self, key, value):
+        self.__setattr__(key, value)
+
+    def __contains__(self, key):
+        return key in self._raw
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._raw.keys()
+
+    def items(self):
+        return [(key, self[key]) for key in self._raw]
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self._raw)
+
+
+class Slot(_Model):
+    __slots__ = _fields = ('name', 'value', 'confirmationStatus', 'resolutions')
+
+
+def _slots(raw):
+    return _Field(dict((name, Slot(slot)) for name, slot in raw.items()))
+
+
+class Intent(_Model):
+    __slots__ = _fields = ('name', 'confirmationStatus', 'slots')
+    _types = {'slots': _slots}
+
+
+class Request(_Model):
+    _fields = ('type', 'requestId', 'locale', 'dialogState', 'intent', 'token', 'offsetInMilliseconds')
+    __slots__ = _fields + ('_timestamp',)
+    _types = {'intent': Intent}
+
+    @property
+    def timestamp(self):
+        # parsed on first access, as with _Field
+        try:
+            return object.__getattribute__(self, '_timestamp')
+        except AttributeError:
+            import aniso8601
+            value = aniso8601.parse_datetime(self._raw.get('timestamp'))
+            object.__setattr__(self, '_timestamp', value)
+            return value
+
+    def __setattr__(self, attr, value):
+        super(Request, self).__setattr__(attr, value)
+        if attr == 'timestamp':
+            try:
+                object.__delattr__(self, '_timestamp')
+            except AttributeError:
+                pass
+
+
+class User(_Model):
+    __slots__ = _fields = ('userId', 'accessToken')
+
+
+class Session(_Model):
+    __slots__ = _fields = ('new', 'sessionId', 'attributes', 'user')
+    _types = {'user': User}
+
+
+class AudioPlayerContext(_Model):
+    __slots__ = _fields = ('token', 'offsetInMilliseconds', 'playerActivity')
+
+
+class Context(_Model):
+    __slots__ = _fields = ('System', 'AudioPlayer')
+    _types = {'AudioPlayer': AudioPlayerContext}
+
+
+class RequestBody(_Model):
+    """Typed counterpart of ``_Field(alexa_json_payload)``."""
+    __slots__ = _fields = ('version', 'session', 'context', 'request')
+    _types = {'session': Session, 'context': Context, 'request': Request}
+
 
 class _Response(object):
 
@@ -165,7 +345,7 @@ class _Response(object):
         self._response['card'] = card
         return self
 
-    def render_response(self):
+    def _render(self):
         response_wrapper = {
             'version': '1.0',
             'response': self._response,
@@ -173,13 +353,29 @@ class _Response(object):
         }
         
         kw = {}
-        if hasattr(session, 'attributes_encoder'):
-            json_encoder = session.attributes_encoder
+        # session fields read as None when missing, so hasattr cannot tell if an encoder was set
+        json_encoder = session.get('attributes_encoder')
+        if json_encoder is not None:
             kwargname = 'cls' if inspect.isclass(json_encoder) else 'default'
             kw[kwargname] = json_encoder
-        dbgdump(response_wrapper, **kw)
+        dbgdump(response_wrapper, event='response', **kw)
+        return response_wrapper, kw
+
+    def render_response(self):
+        response_wrapper, kw = self._render()
+        return json_backend().dumps(response_wrapper, **kw)
+
+    def render_dict(self):
+        """Returns the response as a dict, e.g. for an AWS Lambda handler to return.
 
-        return json.dumps(response_wrapper, **kw)
+        Without a session attributes_encoder no JSON is produced. With one, the response
+        is passed through it so that the dict only holds JSON types.
+        """
+        response_wrapper, kw = self._render()
+        if not kw:
+            return response_wrapper
+        backend = json_backend()
+        return backend.loads(backend.dumps(response_wrapper, **kw))
 
 
 class statement(_Response):
@@ -414,7 +610,7 @@ class audio(_Response):
             stream['offsetInMilliseconds'] = offset
 
         if push_buffer:  # prevents enqueued streams from becoming current_stream
-            push_stream(stream_cache, context['System']['user']['userId'], stream)
+            _current_ask._push_stream(context['System']['user']['userId'], stream)
         return audio_item
 
     def stop(self):
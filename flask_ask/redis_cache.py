@@ -0,0 +1,322 @@
+"""
+Stream cache backed by a Redis server, for skills running on several hosts
+"""
+import os
+import pickle
+import socket
+import threading
+
+from . import cache as stream_cache
+
+
+class RedisError(Exception):
+    """Error reply from the server, or a broken connection."""
+
+
+class _Connection(object):
+    """A socket speaking RESP, the Redis serialization protocol."""
+
+    def __init__(self, host, port, socket_timeout):
+        self._sock = socket.create_connection((host, port), socket_timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile('rb')
+
+    def send(self, commands):
+        """Write several commands in one go, without waiting for their replies."""
+        buf = []
+        for command in commands:
+            buf.append(b'*%d\r\n' % len(command))
+            for arg in command:
+                if not isinstance(arg, bytes):
+                    arg = str(arg).encode('utf-8')
+                buf.append(b'$%d\r\n' % len(arg))
+                buf.append(arg)
+                buf.append(b'\r\n')
+        self._sock.sendall(b''.join(buf))
+
+    def read_reply(self):
+        """Read one reply. Error replies are returned as RedisError instances, not raised."""
+        line = self._file.readline()
+        if not line.endswith(b'\r\n'):
+            raise RedisError('Connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            return RedisError(rest.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self.read_reply() for _ in range(length)]
+        raise RedisError('Unexpected reply {!r}'.format(line))
+
+    def close(self):
+        try:
+            self._file.close()
+            self._sock.close()
+        except socket.error:
+            pass
+
+
+class ConnectionPool(object):
+    """
+    Pool of RESP connections, opened on demand and shared between threads.
+
+    Idle connections are never shared across a fork: a process that finds connections
+    opened by its parent, e.g. a gunicorn --preload worker, drops them and opens its own.
+
+    :param host: server host name
+    :param port: server port
+    :param db: database number selected on each new connection
+    :param password: password sent with AUTH on each new connection, if set
+    :param max_idle: number of idle connections kept open
+    :param socket_timeout: seconds to wait on connect and on each reply
+    """
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, max_idle=16, socket_timeout=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.max_idle = max_idle
+        self.socket_timeout = socket_timeout
+        self._idle = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = _Connection(self.host, self.port, self.socket_timeout)
+        setup = []
+        if self.password is not None:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            conn.send(setup)
+            for reply in [conn.read_reply() for _ in setup]:
+                if isinstance(reply, RedisError):
+                    conn.close()
+                    raise reply
+        return conn
+
+    def execute(self, *commands):
+        """
+        Send commands as a single pipeline and read all their replies.
+
+        :param commands: tuples of command name and arguments
+
+        :return: list of replies, with error replies as RedisError instances
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # inherited sockets are still in use by the parent process
+                inherited, self._idle, self._pid = self._idle, [], os.getpid()
+                for idle in inherited:
+                    idle.close()
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            conn.send(commands)
+            replies = [conn.read_reply() for _ in commands]
+        except (socket.error, RedisError):
+            # the connection is in an unknown state, never reuse it
+            conn.close()
+            raise
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+        return replies
+
+    def disconnect(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def _check(reply):
+    if isinstance(reply, RedisError):
+        raise reply
+    return reply
+
+
+def _wrong_type(reply):
+    return isinstance(reply, RedisError) and str(reply).startswith('WRONGTYPE')
+
+
+class RedisStreamCache(object):
+    """
+    Stream cache on a Redis server, shared by every host running the skill.
+
+    Each user's stream stack is a native Redis list with the top stream first,
+    so top_stream is a single LINDEX. A StreamUnitOfWork commits all of a
+    request's changes in one pipelined MULTI/EXEC: LPUSH, DEL for a set,
+    LTRIM to the maximum depth and PEXPIRE. Stacks stored some other way,
+    e.g. packed with ASK_STREAM_RECORDS outside a request, are kept as
+    plain string values and read back transparently.
+
+    Values are pickled, so the server must be trusted. Connections come from
+    a ConnectionPool, and no client library is needed.
+
+    :param host: server host name
+    :param port: server port
+    :param db: database number
+    :param password: password for AUTH, if the server requires one
+    :param prefix: prepended to every key
+    :param default_timeout: seconds entries are kept when set without a timeout;
+                            0 keeps them until deleted
+    :param pool: ConnectionPool to use instead of creating one from host, port, db and password
+    """
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, prefix='flask-ask:',
+                 default_timeout=300, pool=None):
+        self.prefix = prefix
+        self.default_timeout = default_timeout
+        self.pool = pool if pool is not None else ConnectionPool(host, port, db, password)
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def _expire(self, key, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout > 0:
+            return ('PEXPIRE', key, int(timeout * 1000))
+        return ('PERSIST', key)
+
+    def get(self, key):
+        """
+        :param key: cache key
+
+        :return: stored value, with stacks as lists of streams from bottom to top,
+                 otherwise None if missing or expired
+        """
+        key = self._key(key)
+        stack = self.pool.execute(('LRANGE', key, 0, -1))[0]
+        if _wrong_type(stack):
+            value = _check(self.pool.execute(('GET', key))[0])
+            return pickle.loads(value) if value is not None else None
+        stack = _check(stack)
+        if not stack:
+            return None
+        return [pickle.loads(item) for item in reversed(stack)]
+
+    def set(self, key, value, timeout=None):
+        """
+        :param key: cache key
+        :param value: picklable value; lists are stored as native Redis lists
+        :param timeout: seconds until the entry expires; None uses default_timeout, 0 never expires
+
+        :return: True
+        """
+        key = self._key(key)
+        if isinstance(value, list):
+            commands = [('MULTI',), ('DEL', key)]
+            if value:
+                commands.append(('LPUSH', key) + tuple(_dumps(item) for item in value))
+                commands.append(self._expire(key, timeout))
+            commands.append(('EXEC',))
+            self._transaction(commands)
+        else:
+            command = ('SET', key, _dumps(value))
+            if timeout is None:
+                timeout = self.default_timeout
+            if timeout > 0:
+                command += ('PX', int(timeout * 1000))
+            _check(self.pool.execute(command)[0])
+        return True
+
+    def add(self, key, value, timeout=None):
+        """
+        Store value only if key is not already cached.
+
+        :return: True if stored, False if key was present
+        """
+        if timeout is None:
+            timeout = self.default_timeout
+        command = ('SET', self._key(key), _dumps(value), 'NX')
+        if timeout > 0:
+            command += ('PX', int(timeout * 1000))
+        return _check(self.pool.execute(command)[0]) is not None
+
+    def delete(self, key):
+        """
+        :return: True if key was cached
+        """
+        return _check(self.pool.execute(('DEL', self._key(key)))[0]) == 1
+
+    def has(self, key):
+        return _check(self.pool.execute(('EXISTS', self._key(key)))[0]) == 1
+
+    def clear(self):
+        """Delete every key with this cache's prefix. This scans the whole keyspace."""
+        keys = _check(self.pool.execute(('KEYS', self.prefix + '*'))[0])
+        if keys:
+            _check(self.pool.execute(('DEL',) + tuple(keys))[0])
+        return True
+
+    def stream_top(self, user_id):
+        """
+        Peek at the top of a user's stream stack with a single LINDEX.
+
+        :return: top stream, otherwise None
+        """
+        item = self.pool.execute(('LINDEX', self._key(user_id), 0))[0]
+        if _wrong_type(item):
+            # replaying no operations unpacks a packed stack into a list
+            stack = stream_cache.apply_stream_ops(self.get(user_id), ())
+            return stack[-1] if stack else None
+        item = _check(item)
+        return pickle.loads(item) if item is not None else None
+
+    def apply_stream_ops(self, user_id, ops, max_depth=None, compact=False):
+        """
+        Apply stream operations recorded by a StreamUnitOfWork in one pipelined transaction.
+
+        compact is ignored: the stack stays a native Redis list, one pickled stream per
+        element, so that pushes and stream_top never read the rest of it.
+
+        :return: True
+        """
+        key = self._key(user_id)
+        commands = [('MULTI',)]
+        for op, stream in ops:
+            if op == 'set':
+                commands.append(('DEL', key))
+            commands.append(('LPUSH', key, _dumps(stream)))
+        if max_depth == 0:
+            commands.append(('DEL', key))
+        elif max_depth is not None:
+            commands.append(('LTRIM', key, 0, max_depth - 1))
+        commands.append(self._expire(key, None))
+        commands.append(('EXEC',))
+        results = self._transaction(commands)
+        if any(_wrong_type(result) for result in results):
+            # the stack was stored as a string value; rewrite it as a list
+            stack = stream_cache.apply_stream_ops(self.get(user_id), ops, max_depth)
+            self.set(user_id, stack)
+        return True
+
+    def _transaction(self, commands):
+        replies = self.pool.execute(*commands)
+        for reply in replies[:-1]:
+            _check(reply)
+        return _check(replies[-1])
+
+
+def _dumps(value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
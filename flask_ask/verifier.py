@@ -1,29 +1,480 @@
 import os
 import base64
+import errno
+import hashlib
 import posixpath
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from six.moves.urllib.parse import urlparse
-from six.moves.urllib.request import urlopen
 
-from OpenSSL import crypto
+# cryptography, pyOpenSSL and urllib.request are imported where they are first
+# needed, so skills that never verify signatures do not load them
 
 from . import logger
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
 
 class VerificationError(Exception): pass
 
 
-def load_certificate(cert_url):
+# seconds a request timestamp may differ from the current time
+TIMESTAMP_TOLERANCE = 150
+
+
+# padding and hash of Alexa request signatures, created by _signature_scheme
+_SIGNATURE_SCHEME = None
+
+
+def _signature_scheme():
+    global _SIGNATURE_SCHEME
+    if _SIGNATURE_SCHEME is None:
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+        _SIGNATURE_SCHEME = (padding.PKCS1v15(), hashes.SHA1())
+    return _SIGNATURE_SCHEME
+
+
+class VerifiedCertificate(object):
+    """Alexa signing certificate, validated once and ready to check signatures.
+
+    Parsing the PEM data checks the certificate's expiry and its
+    ``echo-api.amazon.com`` subject alternative name, and raises
+    VerificationError if either is wrong. The public key and expiry are kept,
+    so checking a request signature needs no further certificate work.
+
+    :param pem: PEM encoded certificate chain, as served from SignatureCertChainUrl
+    """
+
+    def __init__(self, pem):
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+        try:
+            cert = x509.load_pem_x509_certificate(pem, default_backend())
+        except ValueError as e:
+            raise VerificationError(e)
+        self.pem = pem
+        self.not_after = _cert_not_after(cert)
+        if datetime.utcnow() >= self.not_after:
+            raise VerificationError("Certificate verification failed")
+        try:
+            san = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+        except x509.ExtensionNotFound:
+            raise VerificationError("Certificate verification failed")
+        if 'echo-api.amazon.com' not in san.value.get_values_for_type(x509.DNSName):
+            raise VerificationError("Certificate verification failed")
+        self.public_key = cert.public_key()
+        self._x509 = None
+
+    @property
+    def x509(self):
+        """The certificate as a pyOpenSSL X509 object, loaded on first use."""
+        if self._x509 is None:
+            from OpenSSL import crypto
+            self._x509 = crypto.load_certificate(crypto.FILETYPE_PEM, self.pem)
+        return self._x509
+
+    def verify(self, signature, signed_data):
+        """
+        Check a request signature against this certificate.
+
+        :param signature: base64 encoded value of the Signature header
+        :param signed_data: raw request body
+
+        :raises VerificationError: if the signature does not match
+        """
+        from cryptography.exceptions import InvalidSignature
+        signature_padding, signature_hash = _signature_scheme()
+        try:
+            self.public_key.verify(base64.b64decode(signature), signed_data,
+                                   signature_padding, signature_hash)
+        except (InvalidSignature, TypeError, ValueError) as e:
+            raise VerificationError(e)
+
+
+class CertificateCache(object):
+    """In-process cache of validated Alexa signing certificates.
+
+    Certificates are keyed by their normalized chain URL and kept until their
+    ``notAfter`` date passes. Once ``max_size`` entries are cached, the least
+    recently used certificate is evicted. Lookups are counted in ``hits`` and
+    ``misses``.
+
+    :param max_size: maximum number of certificates to hold
+    """
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fetch_mutex = threading.Lock()
+
+    def get(self, cert_url):
+        """
+        Look up a certificate.
+
+        :param cert_url: SignatureCertChainUrl of the certificate
+
+        :return: cached certificate, otherwise None if missing or expired
+        """
+        cert = self._lookup(_normalize_certificate_url(cert_url))
+        with self._lock:
+            if cert is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cert
+
+    def set(self, cert_url, cert, not_after):
+        """
+        Store a validated certificate.
+
+        :param cert_url: SignatureCertChainUrl of the certificate
+        :param cert: validated certificate object
+        :param not_after: naive UTC datetime after which the entry is discarded
+        """
+        self._remember(_normalize_certificate_url(cert_url), cert, not_after)
+
+    def load(self, cert_url, loader):
+        """
+        Return the cached certificate, fetching it with ``loader`` on a miss.
+
+        Concurrent misses for the same certificate are serialized so that only
+        one of them calls ``loader``; the others pick up its result.
+
+        :param cert_url: SignatureCertChainUrl of the certificate
+        :param loader: callable taking the url and returning a validated certificate
+
+        :return: certificate object
+        """
+        cert = self.get(cert_url)
+        if cert is not None:
+            return cert
+        key = _normalize_certificate_url(cert_url)
+        with self._fetch_lock(key):
+            cert = self._lookup(key)
+            if cert is None:
+                cert = loader(cert_url)
+                self.set(cert_url, cert, cert.not_after)
+        return cert
+
+    def expires(self, cert_url):
+        """
+        Look up when a cached certificate expires, without counting a hit or miss.
+
+        :param cert_url: SignatureCertChainUrl of the certificate
+
+        :return: naive UTC ``notAfter`` datetime, otherwise None if not cached
+        """
+        key = _normalize_certificate_url(cert_url)
+        if self._lookup(key) is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def delete(self, cert_url):
+        with self._lock:
+            self._entries.pop(_normalize_certificate_url(cert_url), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or datetime.utcnow() >= entry[1]:
+                return None
+            # re-insert to mark as most recently used
+            self._entries[key] = entry
+            return entry[0]
+
+    def _remember(self, key, cert, not_after):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (cert, not_after)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _fetch_lock(self, key):
+        return self._fetch_mutex
+
+
+class FileCertificateCache(CertificateCache):
+    """Certificate cache shared by all worker processes on a host.
+
+    Validated certificates are written as PEM files, prefixed with their expiry,
+    to ``directory``. Files are replaced atomically, and a lock file per
+    certificate makes sure that when several cold workers miss at once, only
+    one of them fetches it. Certificates read from disk are kept in memory
+    as VerifiedCertificate objects, so each worker parses a file at most once.
+
+    Certificates read back from the directory are only checked for their expiry
+    and subject, not their issuer, so anyone able to write to it could plant a
+    certificate and forge requests. The directory must be private: it is created
+    with mode 0700, and an existing one is refused unless it belongs to the
+    current user and cannot be written by group or others.
+
+    :param directory: directory to keep certificates in, created if missing
+    :param max_size: maximum number of certificates each worker holds in memory
+    """
+
+    _EXPIRY_PREFIX = b'Not-After: '
+
+    def __init__(self, directory, max_size=32):
+        super(FileCertificateCache, self).__init__(max_size=max_size)
+        self.directory = directory
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        _check_private_directory(directory)
+
+    def set(self, cert_url, cert, not_after):
+        key = _normalize_certificate_url(cert_url)
+        self._remember(key, cert, not_after)
+        data = self._EXPIRY_PREFIX + not_after.strftime('%Y%m%d%H%M%SZ').encode('ascii') + b'\n' + cert.pem
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            _replace(tmp_path, self._path(key, '.pem'))
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def delete(self, cert_url):
+        super(FileCertificateCache, self).delete(cert_url)
+        try:
+            os.unlink(self._path(_normalize_certificate_url(cert_url), '.pem'))
+        except OSError:
+            pass
+
+    def _lookup(self, key):
+        cert = super(FileCertificateCache, self)._lookup(key)
+        if cert is not None:
+            return cert
+        try:
+            with open(self._path(key, '.pem'), 'rb') as f:
+                header = f.readline()
+                pem = f.read()
+        except IOError:
+            return None
+        if not header.startswith(self._EXPIRY_PREFIX):
+            return None
+        not_after = datetime.strptime(header[len(self._EXPIRY_PREFIX):].strip().decode('ascii'),
+                                      '%Y%m%d%H%M%SZ')
+        if datetime.utcnow() >= not_after:
+            return None
+        try:
+            cert = VerifiedCertificate(pem)
+        except VerificationError:
+            return None
+        self._remember(key, cert, not_after)
+        return cert
+
+    @contextmanager
+    def _fetch_lock(self, key):
+        with self._fetch_mutex:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(key, '.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _path(self, key, suffix):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + suffix)
+
+
+class RequestIdCache(object):
+    """In-process record of recently seen request IDs, for replay protection.
+
+    IDs are kept in a ring of sets, one per ``bucket_seconds`` slice of time.
+    When the ring wraps around, the oldest set is dropped wholesale, so memory
+    is bounded by the request rate over ``window`` seconds and lookups check a
+    fixed number of sets.
+
+    It has the ``add`` method of a werkzeug BasicCache, so a shared cache such
+    as RedisCache or MemcachedCache can be used in its place across workers.
+
+    :param window: seconds an ID is remembered for
+    :param bucket_seconds: width of each time slice
+    """
+
+    def __init__(self, window=TIMESTAMP_TOLERANCE * 2, bucket_seconds=10):
+        self.bucket_seconds = bucket_seconds
+        self._size = -(-window // bucket_seconds) + 1
+        self._buckets = [set() for _ in range(self._size)]
+        self._slots = [None] * self._size
+        self._lock = threading.Lock()
+
+    def add(self, key, value=True, timeout=None):
+        """
+        Record an ID.
+
+        :param key: request ID
+        :param value: ignored, for BasicCache compatibility
+        :param timeout: ignored, IDs are kept for the window given at construction
+
+        :return: True if the ID was recorded, False if it was already seen
+        """
+        slot = int(time.time() // self.bucket_seconds)
+        with self._lock:
+            for i in range(self._size):
+                if key in self._buckets[i] and slot - self._slots[i] < self._size:
+                    return False
+            index = slot % self._size
+            if self._slots[index] != slot:
+                self._buckets[index] = set()
+                self._slots[index] = slot
+            self._buckets[index].add(key)
+        return True
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets)
+
+
+class CertificateRefresher(object):
+    """Background thread that keeps cached certificates fresh.
+
+    Every ``interval`` seconds, each tracked certificate that is missing from
+    ``cache`` or expires within ``lead_time`` seconds is fetched, validated and
+    stored again, so requests never wait on a certificate download.
+
+    Threads do not survive a fork, so when the refresher was started before one,
+    e.g. by init_app in a gunicorn --preload parent, each child starts its own
+    thread the first time it tracks a certificate.
+
+    :param cache: CertificateCache to keep populated
+    :param lead_time: seconds before ``notAfter`` to replace a certificate
+    :param interval: seconds between refresh passes
+    """
+
+    def __init__(self, cache, lead_time=3600, interval=60):
+        self.cache = cache
+        self.lead_time = lead_time
+        self.interval = interval
+        self._urls = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def track(self, cert_url):
+        """Add a certificate URL to the set kept fresh."""
+        if cert_url not in self._urls:
+            with self._lock:
+                self._urls.add(cert_url)
+        if self._thread is not None and self._pid != os.getpid():
+            self.start()
+
+    def refresh(self):
+        """Run a single refresh pass over all tracked certificates."""
+        with self._lock:
+            cert_urls = list(self._urls)
+        for cert_url in cert_urls:
+            not_after = self.cache.expires(cert_url)
+            if not_after is not None and (not_after - datetime.utcnow()).total_seconds() > self.lead_time:
+                continue
+            try:
+                if not _valid_certificate_url(cert_url):
+                    raise VerificationError("Certificate URL verification failed")
+                cert = _fetch_certificate(cert_url)
+            except Exception as e:
+                logger.warning("Failed to refresh certificate {}: {}".format(cert_url, e))
+                continue
+            self.cache.set(cert_url, cert, cert.not_after)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # a thread started in a parent process does not exist in this one
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='flask-ask-cert-refresher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.refresh()
+            self._stopped.wait(self.interval)
+
+
+def warm_up(cert_urls=(), cache=None):
+    """
+    Import the signature checking libraries and load certificates ahead of the first request.
+
+    :param cert_urls: certificate chain URLs to fetch and validate
+    :param cache: CertificateCache to store them in
+
+    :return: list of the URLs that could not be loaded, each logged as a warning
+    """
+    # imported only to load the modules VerifiedCertificate and verify_signature
+    # import on first use
+    import cryptography.x509
+    import cryptography.exceptions
+    import OpenSSL.crypto
+    _signature_scheme()
+    failed = []
+    for cert_url in cert_urls:
+        try:
+            load_certificate(cert_url, cache)
+        except Exception as e:
+            logger.warning("Failed to load certificate {}: {}".format(cert_url, e))
+            failed.append(cert_url)
+    return failed
+
+
+def load_certificate(cert_url, cache=None):
     if not _valid_certificate_url(cert_url):
         raise VerificationError("Certificate URL verification failed")
-    cert_data = urlopen(cert_url).read()
-    cert = crypto.load_certificate(crypto.FILETYPE_PEM, cert_data)
-    if not _valid_certificate(cert):
-        raise VerificationError("Certificate verification failed")
-    return cert
+    if cache is not None:
+        return cache.load(cert_url, _fetch_certificate)
+    return _fetch_certificate(cert_url)
+
+
+def urlopen(url):
+    """Open url with urllib, imported on first use."""
+    from six.moves.urllib.request import urlopen as _urlopen
+    return _urlopen(url)
+
+
+def _fetch_certificate(cert_url):
+    return VerifiedCertificate(urlopen(cert_url).read())
 
 
 def verify_signature(cert, signature, signed_data):
+    if isinstance(cert, VerifiedCertificate):
+        return cert.verify(signature, signed_data)
+    from OpenSSL import crypto
     try:
         signature = base64.b64decode(signature)
         crypto.verify(cert, signature, signed_data, 'sha1')
@@ -33,15 +484,39 @@ def verify_signature(cert, signature, signed_data):
 
 def verify_timestamp(timestamp):
     dt = datetime.utcnow() - timestamp.replace(tzinfo=None)
-    if abs(dt.total_seconds()) > 150:
+    if abs(dt.total_seconds()) > TIMESTAMP_TOLERANCE:
         raise VerificationError("Timestamp verification failed")
 
 
+def verify_request_id(request_id, cache):
+    """
+    Reject a request whose ID was already seen within the timestamp window.
+
+    :param request_id: requestId of the Alexa request
+    :param cache: RequestIdCache or werkzeug BasicCache-like object, whose
+                  ``add`` only succeeds for keys not already present
+    """
+    if not request_id:
+        raise VerificationError("Request ID verification failed")
+    # a request is accepted from TIMESTAMP_TOLERANCE before to TIMESTAMP_TOLERANCE after its timestamp
+    if not cache.add('flask-ask-request:' + request_id, True, timeout=TIMESTAMP_TOLERANCE * 2):
+        raise VerificationError("Request ID replay detected")
+
+
 def verify_application_id(candidate, records):
     if candidate not in records:
         raise VerificationError("Application ID verification failed")
 
 
+def _normalize_certificate_url(cert_url):
+    parsed_url = urlparse(cert_url)
+    host = (parsed_url.hostname or '').lower()
+    if parsed_url.port not in (None, 443):
+        host = '{}:{}'.format(host, parsed_url.port)
+    path = posixpath.normpath(parsed_url.path) if parsed_url.path else ''
+    return '{}://{}{}'.format(parsed_url.scheme.lower(), host, path)
+
+
 def _valid_certificate_url(cert_url):
     parsed_url = urlparse(cert_url)
     if parsed_url.scheme == 'https':
@@ -51,19 +526,26 @@ def _valid_certificate_url(cert_url):
     return False
 
 
-def _valid_certificate(cert):
-    not_after = cert.get_notAfter().decode('utf-8')
-    not_after = datetime.strptime(not_after, '%Y%m%d%H%M%SZ')
-    if datetime.utcnow() >= not_after:
-        return False
-    found = False
-    for i in range(0, cert.get_extension_count()):
-        extension = cert.get_extension(i)
-        short_name = extension.get_short_name().decode('utf-8')
-        value = str(extension)
-        if 'subjectAltName' == short_name and 'DNS:echo-api.amazon.com' == value:
-                found = True
-                break
-    if not found:
-        return False
-    return True
+def _check_private_directory(directory):
+    st = os.stat(directory)
+    if not stat.S_ISDIR(st.st_mode):
+        raise VerificationError("Certificate cache {} is not a directory".format(directory))
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise VerificationError("Certificate cache directory {} is not owned by the current user".format(directory))
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise VerificationError("Certificate cache directory {} is writable by group or others".format(directory))
+
+
+def _replace(src, dst):
+    # os.replace is atomic on every platform but only exists on Python 3
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        os.rename(src, dst)
+
+
+def _cert_not_after(cert):
+    # cryptography 42 deprecates the naive datetime in favor of not_valid_after_utc
+    if hasattr(cert, 'not_valid_after_utc'):
+        return cert.not_valid_after_utc.replace(tzinfo=None)
+    return cert.not_valid_after
@@ -1,7 +1,9 @@
+import json
 import unittest
 from mock import patch, MagicMock
 from flask import Flask
-from flask_ask import Ask, audio
+from werkzeug.contrib.cache import SimpleCache
+from flask_ask import Ask, audio, current_stream
 from flask_ask.models import _Field
 
 
@@ -63,5 +65,88 @@ class AskStreamHandlingTests(unittest.TestCase):
             self.assertEqual(fake_stream, from_buffer)
 
 
+class CountingCache(SimpleCache):
+
+    def __init__(self):
+        super(CountingCache, self).__init__()
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append('get')
+        return super(CountingCache, self).get(key)
+
+    def set(self, key, value, timeout=None):
+        self.calls.append('set')
+        return super(CountingCache, self).set(key, value, timeout)
+
+
+class StreamStateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['ASK_VERIFY_REQUESTS'] = False
+        self.cache = CountingCache()
+        self.ask = Ask(self.app, '/ask', stream_cache=self.cache)
+        self.client = self.app.test_client()
+
+    def post(self, request):
+        body = {'version': '1.0', 'session': {'new': False},
+                'context': {'System': {'user': {'userId': 'dave'}}, 'AudioPlayer': {'offsetInMilliseconds': 5}},
+                'request': request}
+        return self.client.post('/ask', data=json.dumps(body))
+
+    def test_stream_is_loaded_and_stored_once_per_request(self):
+        @self.ask.intent('PlayIntent')
+        def play():
+            current_stream.url
+            return audio('playing').play('https://first').enqueue('https://second')
+
+        response = self.post({'type': 'IntentRequest', 'intent': {'name': 'PlayIntent', 'slots': {}}})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['get', 'set'], self.cache.calls)
+        self.assertEqual('https://first', self.cache.get('dave')[-1]['url'])
+
+    def test_stream_is_not_stored_when_the_request_fails(self):
+        self.cache.set('dave', [{'url': 'https://before', 'token': 'abc'}])
+
+        @self.ask.intent('PlayIntent')
+        def play():
+            audio('playing').play('https://after')
+            raise RuntimeError('boom')
+
+        self.assertEqual(500, self.post({'type': 'IntentRequest', 'intent': {'name': 'PlayIntent', 'slots': {}}}).status_code)
+        self.assertEqual([{'url': 'https://before', 'token': 'abc'}], self.cache.get('dave'))
+
+    def test_stream_is_stored_when_the_app_context_is_reused(self):
+        @self.ask.intent('PlayIntent')
+        def play():
+            return audio('playing').play('https://first')
+
+        with self.app.app_context() as ctx:
+            response = self.post({'type': 'IntentRequest', 'intent': {'name': 'PlayIntent', 'slots': {}}})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual('https://first', self.cache.get('dave')[-1]['url'])
+            self.assertFalse(hasattr(ctx, '_ask_stream_state'))
+            self.post({'type': 'IntentRequest', 'intent': {'name': 'PlayIntent', 'slots': {}}})
+            self.assertEqual(2, len(self.cache.get('dave')))
+
+    def test_unbuffered_writes_honor_stream_settings(self):
+        self.app.config['ASK_STREAM_MAX_DEPTH'] = 2
+        self.ask._buffer_streams = False
+
+        @self.ask.intent('PlayIntent')
+        def play():
+            return audio('playing').play('https://first')
+
+        for _ in range(3):
+            self.post({'type': 'IntentRequest', 'intent': {'name': 'PlayIntent', 'slots': {}}})
+        self.assertEqual(2, len(self.cache.get('dave')))
+
+        self.app.config['ASK_STREAM_RECORDS'] = True
+        with self.app.app_context():
+            self.ask._push_stream('dave', {'url': 'https://second', 'token': 'abc'})
+        self.assertIsInstance(self.cache.get('dave'), bytes)
+
+
 if __name__ == '__main__':
     unittest.main()
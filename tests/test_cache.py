@@ -1,8 +1,13 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
 import unittest
 from mock import patch, Mock
 from werkzeug.contrib.cache import SimpleCache
 from flask_ask.core import Ask
-from flask_ask.cache import push_stream, pop_stream, top_stream, set_stream
+from flask_ask.cache import push_stream, pop_stream, top_stream, set_stream, StreamUnitOfWork, \
+    StreamRecord, pack_streams, unpack_streams, ShardedLRUCache, SQLiteCache
 
 
 class CacheTests(unittest.TestCase):
@@ -55,6 +60,264 @@ class CacheTests(unittest.TestCase):
         self.assertFalse(mock.get.called)
         self.assertIsNone(result)
 
+    def test_top_does_not_modify_cached_stack(self):
+        cache = DictCache()
+        push_stream(cache, self.user_id, '1')
+        push_stream(cache, self.user_id, '2')
+        self.assertEqual('2', top_stream(cache, self.user_id))
+        self.assertEqual('2', top_stream(cache, self.user_id))
+        self.assertEqual(['1', '2'], cache.data[self.user_id])
+
+
+class DictCache(object):
+    """ Cache keeping values by reference, with versions for compare-and-set """
+
+    def __init__(self):
+        self.data = {}
+        self.versions = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        return True
+
+
+class CASCache(DictCache):
+
+    def get_for_update(self, key):
+        return self.data.get(key), self.versions.get(key, 0)
+
+    def compare_and_set(self, key, value, version):
+        if self.versions.get(key, 0) != version:
+            return False
+        self.versions[key] = version + 1
+        return self.set(key, value)
+
+
+class StreamUnitOfWorkTests(unittest.TestCase):
+
+    def test_changes_are_visible_and_written_once(self):
+        cache = Mock(wraps=DictCache(), spec=['get', 'set', 'delete'])
+        cache.get.return_value = [{'token': 'old'}]
+        work = StreamUnitOfWork(cache, 'dave')
+        work.set({'token': 'a'})
+        work.push({'token': 'b'})
+        self.assertIsNone(work.push(None))
+        self.assertEqual({'token': 'b'}, work.top())
+        self.assertFalse(cache.set.called)
+
+        self.assertTrue(work.commit())
+        cache.get.assert_called_once_with('dave')
+        cache.set.assert_called_once_with('dave', [{'token': 'a'}, {'token': 'b'}])
+        self.assertTrue(work.commit())
+        self.assertEqual(1, cache.set.call_count)
+
+    def test_concurrent_changes_are_not_lost(self):
+        cache = CASCache()
+        first = StreamUnitOfWork(cache, 'dave')
+        second = StreamUnitOfWork(cache, 'dave')
+        first.push('1')
+        second.push('2')
+        self.assertTrue(first.commit())
+        self.assertTrue(second.commit())
+        self.assertEqual(['1', '2'], cache.data['dave'])
+
+    def test_gives_up_after_retries(self):
+        cache = CASCache()
+        cache.compare_and_set = Mock(return_value=False)
+        work = StreamUnitOfWork(cache, 'dave', retries=2)
+        work.push('1')
+        self.assertFalse(work.commit())
+        self.assertEqual(3, cache.compare_and_set.call_count)
+
+    def test_cache_can_apply_operations_itself(self):
+        cache = Mock(spec=['get', 'apply_stream_ops'])
+        cache.get.return_value = None
+        work = StreamUnitOfWork(cache, 'dave')
+        work.set('1')
+        work.push('2')
+        work.commit()
+        cache.apply_stream_ops.assert_called_once_with('dave', [('set', '1'), ('push', '2')], None, compact=False)
+
+
+class StreamRecordTests(unittest.TestCase):
+
+    def test_round_trip(self):
+        streams = [
+            {'url': 'https://example.com/\u00e9t\u00e9.mp3', 'token': 'abc', 'offsetInMilliseconds': 123},
+            {'url': 'https://example.com/b.mp3', 'token': 'def', 'offsetInMilliseconds': 0,
+             'expectedPreviousToken': 'abc'},
+            {'token': ''},
+        ]
+        data = pack_streams(streams)
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(streams, unpack_streams(data))
+        record, pos = StreamRecord.unpack_from(data)
+        self.assertEqual(123, record.offset)
+        self.assertEqual(len(StreamRecord.from_stream(streams[0]).pack()), pos)
+
+    def test_only_fixed_fields_are_kept(self):
+        stream = {'url': 'u', 'token': 't', 'offsetInMilliseconds': '5', 'playerActivity': 'PLAYING'}
+        self.assertEqual([{'url': 'u', 'token': 't', 'offsetInMilliseconds': 5}],
+                         unpack_streams(pack_streams([stream])))
+
+    def test_compact_bounded_stacks(self):
+        cache = SimpleCache()
+        for i in range(5):
+            push_stream(cache, 'dave', {'url': 'u', 'token': str(i)}, max_depth=3, compact=True)
+        self.assertIsInstance(cache.get('dave'), bytes)
+        self.assertEqual({'url': 'u', 'token': '4'}, top_stream(cache, 'dave'))
+        self.assertEqual(['2', '3', '4'], [s['token'] for s in unpack_streams(cache.get('dave'))])
+
+        self.assertEqual({'url': 'u', 'token': '4'}, pop_stream(cache, 'dave'))
+        self.assertEqual(['2', '3'], [s['token'] for s in unpack_streams(cache.get('dave'))])
+
+        work = StreamUnitOfWork(cache, 'dave', max_depth=2, compact=True)
+        work.push({'token': '5'})
+        work.commit()
+        self.assertEqual(['3', '5'], [s['token'] for s in unpack_streams(cache.get('dave'))])
+
+
+class ShardedLRUCacheTests(unittest.TestCase):
+
+    def test_basic_cache_methods(self):
+        cache = ShardedLRUCache()
+        stack = [{'token': 'a'}]
+        self.assertIsNone(cache.get('dave'))
+        self.assertTrue(cache.set('dave', stack))
+        self.assertIs(stack, cache.get('dave'))
+        self.assertFalse(cache.add('dave', []))
+        self.assertTrue(cache.add('hal', []))
+        self.assertTrue(cache.has('hal'))
+        self.assertTrue(cache.delete('hal'))
+        self.assertFalse(cache.delete('hal'))
+        self.assertEqual({'entries': 1, 'hits': 1, 'misses': 1, 'evictions': 0, 'expirations': 0}, cache.stats())
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ShardedLRUCache(max_size=2, shards=1)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual([1, None, 3], [cache.get(k) for k in 'abc'])
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_entries_expire(self):
+        cache = ShardedLRUCache(default_timeout=10)
+        with patch('flask_ask.cache.time.time', return_value=1000):
+            cache.set('a', 1)
+            cache.set('b', 2, timeout=0)
+        with patch('flask_ask.cache.time.time', return_value=1010):
+            self.assertIsNone(cache.get('a'))
+            self.assertEqual(2, cache.get('b'))
+        self.assertEqual(1, cache.stats()['expirations'])
+        self.assertEqual(1, len(cache))
+
+    def test_stream_operations_are_atomic(self):
+        cache = ShardedLRUCache()
+        push_stream(cache, 'dave', {'token': 'a'})
+        first = StreamUnitOfWork(cache, 'dave', max_depth=2)
+        second = StreamUnitOfWork(cache, 'dave', max_depth=2)
+        first.push({'token': 'b'})
+        second.push({'token': 'c'})
+        first.commit()
+        second.commit()
+        self.assertEqual([{'token': 'b'}, {'token': 'c'}], cache.get('dave'))
+
+        value, version = cache.get_for_update('dave')
+        self.assertTrue(cache.compare_and_set('dave', [], version))
+        self.assertFalse(cache.compare_and_set('dave', value, version))
+        self.assertTrue(cache.compare_and_set('new', [], 0))
+
+    def test_compact_stacks(self):
+        cache = ShardedLRUCache()
+        work = StreamUnitOfWork(cache, 'dave', compact=True)
+        work.push({'token': 'a'})
+        work.commit()
+        self.assertEqual(pack_streams([{'token': 'a'}]), cache.get('dave'))
+
+
+def push_from_worker(path, token):
+    work = StreamUnitOfWork(SQLiteCache(path), 'dave')
+    work.push({'token': token})
+    work.commit()
+
+
+class SQLiteCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'streams.db')
+        self.cache = SQLiteCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def test_basic_cache_methods(self):
+        self.assertIsNone(self.cache.get('dave'))
+        self.assertTrue(self.cache.set('dave', [{'token': 'a'}]))
+        self.assertEqual([{'token': 'a'}], self.cache.get('dave'))
+        self.assertFalse(self.cache.add('dave', []))
+        self.assertTrue(self.cache.add('hal', []))
+        self.assertTrue(self.cache.has('hal'))
+        self.assertTrue(self.cache.delete('hal'))
+        self.assertFalse(self.cache.delete('hal'))
+        self.cache.set_many({'a': 1, 'b': b'packed'})
+        self.assertEqual([1, b'packed', None], self.cache.get_many('a', 'b', 'c'))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('dave'))
+
+    def test_entries_expire_and_are_cleaned_up(self):
+        with patch('flask_ask.cache.time.time', return_value=1000):
+            self.cache.set('a', 1, timeout=10)
+            self.cache.set('b', 2, timeout=0)
+        with patch('flask_ask.cache.time.time', return_value=1010):
+            self.assertIsNone(self.cache.get('a'))
+            self.assertTrue(self.cache.add('a', 3))
+            self.assertEqual(3, self.cache.get('a'))
+        with patch('flask_ask.cache.time.time', return_value=2000):
+            self.cache.set('c', 4)
+        rows = self.cache._connection().execute('SELECT key FROM stream_cache ORDER BY key').fetchall()
+        self.assertEqual([('b',), ('c',)], rows)
+
+    def test_compare_and_set(self):
+        value, version = self.cache.get_for_update('dave')
+        self.assertEqual((None, 0), (value, version))
+        self.assertTrue(self.cache.compare_and_set('dave', ['a'], version))
+        self.assertFalse(self.cache.compare_and_set('dave', ['b'], version))
+        value, version = self.cache.get_for_update('dave')
+        self.assertTrue(self.cache.compare_and_set('dave', value + ['b'], version))
+        self.assertEqual(['a', 'b'], self.cache.get('dave'))
+
+    def test_compact_stacks(self):
+        push_stream(self.cache, 'dave', {'token': 'a'})
+        work = StreamUnitOfWork(self.cache, 'dave', compact=True)
+        work.push({'token': 'b'})
+        work.commit()
+        self.assertEqual(pack_streams([{'token': 'a'}, {'token': 'b'}]), self.cache.get('dave'))
+
+    def test_workers_share_streams(self):
+        push_stream(self.cache, 'dave', {'token': 'a'})
+        workers = [multiprocessing.Process(target=push_from_worker, args=(self.path, t)) for t in 'bc']
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(['a', 'b', 'c'], sorted(s['token'] for s in self.cache.get('dave')))
+
+        work = StreamUnitOfWork(self.cache, 'dave', max_depth=2)
+        work.set({'token': 'd'})
+        work.push({'token': 'e'})
+        work.commit()
+        self.assertEqual({'token': 'e'}, top_stream(SQLiteCache(self.path), 'dave'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 import unittest
 from aniso8601.timezone import UTCOffset, build_utcoffset
-from flask_ask.core import Ask
-
-from datetime import datetime, timedelta
+import inspect
+import logging
+from flask_ask import logger
+from flask import Flask, Blueprint
+from flask_ask import statement, request
+from flask_ask.core import Ask, dbgdump, find_ask
+from flask_ask.models import _Field
+from flask_ask.verifier import VerificationError
+
+from datetime import date, datetime, timedelta
 from mock import patch, MagicMock
 import json
+import subprocess
+import sys
+import threading
+import time
 
 
 class FakeRequest(object):
@@ -42,6 +53,19 @@ class TestCoreRoutines(unittest.TestCase):
         ask._alexa_request()
 
 
+    @patch('flask_ask.core.flask_request',
+           new=FakeRequest({'request': {'timestamp': 1234, 'requestId': 'amzn1.echo-api.request.1'},
+                            'session': {'application': {'applicationId': 1}}}))
+    def test_alexa_request_replay_is_rejected(self):
+        ask = Ask()
+        ask._alexa_request()
+        ask._alexa_request()
+
+        self.mock_app.config['ASK_VERIFY_REPLAY'] = True
+        ask._alexa_request()
+        with self.assertRaises(VerificationError):
+            ask._alexa_request()
+
     def test_parse_timestamp(self):
         utc = build_utcoffset('UTC', timedelta(hours=0))
         result = Ask._parse_timestamp('2017-07-08T07:38:00Z')
@@ -72,7 +96,157 @@ class TestCoreRoutines(unittest.TestCase):
             # still raise an error if too large
             Ask._parse_timestamp(max_timestamp * 1000)
 
+    @patch('flask_ask.core.json_backend')
+    def test_dbgdump_is_lazy(self, json_backend):
+        with patch.object(logger, 'isEnabledFor', return_value=False):
+            dbgdump({'a': 1})
+        json_backend.assert_not_called()
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        with patch.object(logger, 'handlers', [handler]), patch.object(logger, 'propagate', False), \
+                patch.object(logger, 'isEnabledFor', return_value=True):
+            dbgdump({'a': 1}, event='request')
+        json_backend.return_value.dumps.assert_not_called()
+
+        self.assertEqual('request', records[0].ask_event)
+        self.assertEqual({'a': 1}, records[0].ask_data)
+        json_backend.return_value.dumps.return_value = '{"a": 1}'
+        self.assertEqual('{"a": 1}', records[0].getMessage())
+
     def tearDown(self):
         self.patch_current_app.stop()
         self.patch_load_cert.stop()
         self.patch_verify_sig.stop()
+
+
+class TestViewBinding(unittest.TestCase):
+    """ Tests for binding request parameters to view functions """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.ask = Ask(self.app, '/ask')
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def intent_request(self, **slots):
+        return _Field({'type': 'IntentRequest', 'intent': {
+            'name': 'TestIntent', 'slots': {k: {'name': k, 'value': v} for k, v in slots.items()}}})
+
+    def test_signature_is_inspected_once(self):
+        with patch('flask_ask.core.inspect.getfullargspec', wraps=inspect.getfullargspec) as getfullargspec:
+            @self.ask.intent('TestIntent', mapping={'city': 'City'}, convert={'day': 'date', 'count': int},
+                             default={'count': lambda: 3, 'city': 'Paris'})
+            def test_intent(city, day, count):
+                return city, day, count
+
+            self.ask.request = self.intent_request(City='Lyon', day='2017-07-08')
+            self.assertEqual(('Lyon', date(2017, 7, 8), 3), self.ask._map_intent_to_view_func(self.ask.request.intent)())
+            self.ask.request = self.intent_request(count='x')
+            self.assertEqual(('Paris', None, 'x'), self.ask._map_intent_to_view_func(self.ask.request.intent)())
+            self.assertIsInstance(self.ask.convert_errors['count'], ValueError)
+
+        self.assertEqual(1, getfullargspec.call_count)
+
+    def test_default_intent_and_player_requests(self):
+        @self.ask.default_intent
+        def fallback():
+            return 'fallback'
+
+        @self.ask.on_playback_stopped()
+        def stopped(token, offset):
+            return token, offset
+
+        self.ask.request = self.intent_request()
+        self.assertEqual('fallback', self.ask._request_handlers['IntentRequest']())
+        self.ask.request = _Field({'type': 'AudioPlayer.PlaybackStopped', 'token': 'abc', 'offsetInMilliseconds': 10})
+        self.assertEqual(('abc', 10), self.ask._request_handlers['AudioPlayer.PlaybackStopped']())
+        self.assertNotIn('AudioPlayer.PlaybackFailed', self.ask._request_handlers)
+
+    def test_request_types_route_exactly(self):
+        @self.ask.on_request('CanFulfillIntentRequest', mapping={'city': 'City'})
+        def can_fulfill(city):
+            return '{"canFulfill": "%s"}' % city, 200
+
+        client = self.app.test_client()
+        self.app.config['ASK_VERIFY_REQUESTS'] = False
+
+        def post(request):
+            return client.post('/ask', data=json.dumps({'version': '1.0', 'session': {'new': False}, 'request': request}))
+
+        response = post({'type': 'CanFulfillIntentRequest', 'intent': {
+            'name': 'TestIntent', 'slots': {'City': {'name': 'City', 'value': 'Paris'}}}})
+        self.assertEqual(b'{"canFulfill": "Paris"}', response.data)
+        self.assertEqual(b'{}', post({'type': 'SessionEndedRequest'}).data)
+        self.assertEqual(400, post({'type': 'IntentRequest', 'intent': {'name': 'TestIntent'}}).status_code)
+        self.assertEqual(400, post({'type': 'AudioPlayer.PlaybackFailed'}).status_code)
+
+
+class TestFindAsk(unittest.TestCase):
+    """ Tests for resolving the Ask instance behind the context locals """
+
+    def test_each_blueprint_gets_its_own_ask(self):
+        app = Flask(__name__)
+        app.config['ASK_VERIFY_REQUESTS'] = False
+        seen = []
+        for name in ('first', 'second'):
+            blueprint = Blueprint(name, __name__, url_prefix='/' + name)
+            ask = Ask(blueprint=blueprint)
+
+            @ask.launch
+            def launched(ask=ask):
+                seen.append((find_ask(), ask))
+                return statement(request.type)
+
+            app.register_blueprint(blueprint)
+
+        client = app.test_client()
+        body = json.dumps({'version': '1.0', 'session': {'new': False}, 'request': {'type': 'LaunchRequest'}})
+        for name in ('first', 'second', 'first'):
+            self.assertEqual(200, client.post('/' + name, data=body).status_code)
+        self.assertEqual(3, len(seen))
+        for found, expected in seen:
+            self.assertIs(expected, found)
+        self.assertIsNot(seen[0][1], seen[1][1])
+
+    def test_lookup_is_remembered_for_the_app_context(self):
+        app = Flask(__name__)
+        ask = Ask(app, '/ask')
+        with app.app_context():
+            self.assertIs(ask, find_ask())
+            del app.ask
+            self.assertIs(ask, find_ask())
+        with app.app_context():
+            self.assertIsNone(find_ask())
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_optional_dependencies_load_on_first_use(self):
+        script = ("import sys, flask_ask; print(' '.join(m for m in ('yaml', 'aniso8601', 'OpenSSL', "
+                  "'cryptography', 'werkzeug.contrib.cache', 'sqlite3') if m in sys.modules))")
+        loaded = subprocess.check_output([sys.executable, '-c', script]).decode('utf-8').split()
+        self.assertEqual([], loaded)
+
+    def test_default_stream_cache_is_created_once(self):
+        from werkzeug.contrib.cache import SimpleCache
+        ask = Ask()
+        caches = []
+
+        def slow_cache():
+            time.sleep(0.05)
+            caches.append(SimpleCache())
+            return caches[-1]
+
+        with patch('werkzeug.contrib.cache.SimpleCache', side_effect=slow_cache):
+            threads = [threading.Thread(target=lambda: ask.stream_cache) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(1, len(caches))
+        self.assertIs(caches[0], ask.stream_cache)
@@ -1,9 +1,17 @@
+import copy
+from datetime import date
+import os
+import shutil
+import tempfile
+import time
 import unittest
 import json
 import uuid
 
-from flask_ask import Ask, audio
-from flask import Flask
+from flask_ask import Ask, audio, session, statement
+from flask_ask.cache import top_stream
+from flask import Flask, render_template
+from mock import patch
 
 
 play_request = {
@@ -118,5 +126,170 @@ class AudioIntegrationTests(unittest.TestCase):
         play_request['request']['intent']['name'] = original_intent_name
 
 
+class LambdaIntegrationTests(unittest.TestCase):
+    """ Integration tests of run_aws_lambda, through WSGI and dispatching the event directly """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.ask = Ask(app=self.app, route='/')
+
+        @self.ask.intent('TestPlay')
+        def play():
+            return audio('playing').play('https://fakestream', opaque_token='token')
+
+    def test_direct_matches_wsgi(self):
+        through_wsgi = self.ask.run_aws_lambda(copy.deepcopy(play_request))
+        direct = self.ask.run_aws_lambda(copy.deepcopy(play_request), direct=True)
+        self.assertEqual(through_wsgi, json.loads(json.dumps(direct)))
+        self.assertEqual('playing', direct['response']['outputSpeech']['text'])
+
+    def test_wsgi_environ_is_built_once(self):
+        event = copy.deepcopy(play_request)
+        event['session']['attributes'] = {'city': u'Z\u00fcrich \u2615'}
+        self.ask.run_aws_lambda(copy.deepcopy(event))
+        environ = self.ask._lambda_environ_template
+        response = self.ask.run_aws_lambda(event)
+        self.assertIs(environ, self.ask._lambda_environ_template)
+        self.assertNotIn('wsgi.input', environ)
+        self.assertEqual(u'Z\u00fcrich \u2615', response['sessionAttributes']['city'])
+
+    def test_direct_saves_streams(self):
+        self.ask.run_aws_lambda(copy.deepcopy(play_request), direct=True)
+        user_id = play_request['context']['System']['user']['userId']
+        self.assertEqual('https://fakestream', top_stream(self.ask.stream_cache, user_id)['url'])
+
+    def test_direct_produces_no_json(self):
+        with patch('flask_ask.json_backends.FlaskJSON.dumps') as dumps, \
+                patch('flask_ask.json_backends.FlaskJSON.loads') as loads:
+            response = self.ask.run_aws_lambda(copy.deepcopy(play_request), direct=True)
+        dumps.assert_not_called()
+        loads.assert_not_called()
+        self.assertEqual('playing', response['response']['outputSpeech']['text'])
+
+    def test_direct_honors_attributes_encoder(self):
+        @self.ask.intent('TestDate')
+        def remember_date():
+            session.attributes['day'] = date(2017, 7, 8)
+            session.attributes_encoder = lambda o: o.isoformat()
+            return statement('noted')
+
+        event = copy.deepcopy(play_request)
+        event['request']['intent']['name'] = 'TestDate'
+        response = self.ask.run_aws_lambda(event, direct=True)
+        self.assertEqual('2017-07-08', response['sessionAttributes']['day'])
+
+    def test_direct_non_response_results(self):
+        session_ended = copy.deepcopy(play_request)
+        session_ended['request'] = {'type': 'SessionEndedRequest', 'requestId': 'string', 'reason': 'USER_INITIATED'}
+        self.assertEqual({}, self.ask.run_aws_lambda(session_ended, direct=True))
+
+        unhandled = copy.deepcopy(play_request)
+        unhandled['request'] = {'type': 'Display.ElementSelected', 'requestId': 'string'}
+        with self.assertRaises(AssertionError):
+            self.ask.run_aws_lambda(unhandled, direct=True)
+
+
+class WarmUpTests(unittest.TestCase):
+    """ Tests of Ask.warm_up """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        with open(os.path.join(self.root, 'templates.yaml'), 'w') as f:
+            f.write('welcome: Welcome {{ name }}\nbye: Goodbye\n')
+        self.app = Flask(__name__, root_path=self.root)
+        self.app.config['ASK_CERT_URLS'] = ['https://s3.amazonaws.com/echo.api/echo-api-cert.pem']
+        self.ask = Ask(app=self.app, route='/')
+        self.launches = []
+
+        @self.ask.on_session_started
+        def started():
+            self.launches.append('started')
+
+        @self.ask.launch
+        def launch():
+            self.launches.append(self.ask.request.type)
+            return audio(render_template('welcome', name='back')).play('https://fakestream')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_warm_up(self):
+        with patch('flask_ask.core.verifier.warm_up') as verifier_warm_up:
+            self.ask.warm_up(launch=True)
+        verifier_warm_up.assert_called_once_with(self.app.config['ASK_CERT_URLS'], self.ask.cert_cache)
+        self.assertEqual(['LaunchRequest'], self.launches)
+        self.assertIsNone(self.ask.stream_cache.get('amzn1.ask.account.flask-ask-warm-up'))
+
+        # every template was compiled, so rendering does not go back to the loader
+        with patch('flask_ask.core.YamlLoader.get_source') as get_source, self.app.app_context():
+            self.assertEqual('Goodbye', render_template('bye'))
+        get_source.assert_not_called()
+
+    def test_warm_up_at_init_app(self):
+        app = Flask(__name__, root_path=self.root)
+        app.config['ASK_WARM_UP'] = True
+        app.config['ASK_VERIFY_REQUESTS'] = False
+        with patch('flask_ask.core.verifier.warm_up') as verifier_warm_up:
+            Ask(app=app, route='/')
+        verifier_warm_up.assert_not_called()
+        self.assertTrue(app.jinja_env.cache)
+
+
+class TemplateReloadTests(unittest.TestCase):
+    """ Tests of ASK_TEMPLATE_RELOAD_INTERVAL """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write('Hello')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, text, mtime=1000):
+        path = os.path.join(self.root, 'templates.yaml')
+        with open(path, 'w') as f:
+            f.write('greeting: {}\n'.format(text))
+        os.utime(path, (mtime, mtime))
+
+    def make_ask(self, interval, auto_reload=True):
+        app = Flask(__name__, root_path=self.root)
+        app.config['TEMPLATES_AUTO_RELOAD'] = auto_reload
+        app.config['ASK_TEMPLATE_RELOAD_INTERVAL'] = interval
+        return app, Ask(app=app, route='/')
+
+    def test_file_checked_once_per_interval(self):
+        app, ask = self.make_ask(60)
+        with app.app_context():
+            self.assertEqual('Hello', render_template('greeting'))
+            self.write('Howdy', mtime=2000)
+            with patch('flask_ask.core.os.path.getmtime', wraps=os.path.getmtime) as getmtime:
+                for _ in range(10):
+                    self.assertEqual('Hello', render_template('greeting'))
+            getmtime.assert_not_called()
+            with patch('flask_ask.core.time.time', return_value=time.time() + 61):
+                self.assertEqual('Howdy', render_template('greeting'))
+
+    def test_explicit_reload_only(self):
+        app, ask = self.make_ask(0)
+        with app.app_context():
+            self.assertEqual('Hello', render_template('greeting'))
+            self.write('Howdy', mtime=2000)
+            with patch('flask_ask.core.time.time', return_value=time.time() + 3600):
+                self.assertEqual('Hello', render_template('greeting'))
+            ask.reload_templates()
+            self.assertEqual('Howdy', render_template('greeting'))
+
+    def test_explicit_reload_without_auto_reload(self):
+        for interval in (None, 60, 0):
+            self.write('Hello')
+            app, ask = self.make_ask(interval, auto_reload=False)
+            with app.app_context():
+                self.assertFalse(app.jinja_env.auto_reload)
+                self.assertEqual('Hello', render_template('greeting'))
+                self.write('Howdy', mtime=2000)
+                ask.reload_templates()
+                self.assertEqual('Howdy', render_template('greeting'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,102 @@
+import json
+import unittest
+from datetime import date
+
+from flask import Flask
+from mock import patch
+
+from flask_ask import Ask, statement, session
+from flask_ask.json_backends import get_backend, StdlibJSON
+
+
+launch = {
+    "version": "1.0",
+    "session": {
+        "new": True,
+        "application": {"applicationId": "fake-application-id"},
+        "attributes": {},
+        "user": {"userId": "amzn1.account.AM3B00000000000000000000000"}
+    },
+    "request": {"type": "LaunchRequest", "requestId": "string", "timestamp": "string", "locale": "string"}
+}
+
+
+def installed(name):
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+class DateEncoder(json.JSONEncoder):
+
+    def default(self, o):
+        if isinstance(o, date):
+            return o.isoformat()
+        return super(DateEncoder, self).default(o)
+
+
+class JSONBackendTests(unittest.TestCase):
+
+    def test_backends_round_trip(self):
+        for name in ('flask', 'json', 'ujson', 'orjson', 'auto'):
+            backend = get_backend(name)
+            obj = {'url': 'https://example.com/a', 'text': u'f\xfcr dich', 'n': [1, 2.5, None, True]}
+            self.assertEqual(obj, backend.loads(backend.dumps(obj).encode('utf-8')))
+            self.assertEqual(obj, json.loads(backend.dumps(obj, indent=2)))
+
+    def test_encoder_class_and_default_are_honored(self):
+        for name in ('json', 'ujson', 'orjson'):
+            backend = get_backend(name)
+            obj = {'day': date(2017, 7, 8)}
+            self.assertEqual({'day': '2017-07-08'}, json.loads(backend.dumps(obj, cls=DateEncoder)))
+            self.assertEqual({'day': '2017-07-08'}, json.loads(backend.dumps(obj, default=lambda o: o.isoformat())))
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            get_backend('yaml')
+
+    def test_missing_backend_falls_back_to_stdlib(self):
+        with patch.dict('flask_ask.json_backends._backends', clear=True), \
+                patch.dict('sys.modules', {'orjson': None}):
+            self.assertIsInstance(get_backend('orjson'), StdlibJSON)
+
+    @unittest.skipUnless(installed('orjson'), 'orjson is not installed')
+    def test_responses_render_through_configured_backend(self):
+        app = Flask(__name__)
+        app.config['ASK_VERIFY_REQUESTS'] = False
+        app.config['ASK_JSON_BACKEND'] = 'orjson'
+        ask = Ask(app, '/ask')
+
+        @ask.launch
+        def launched():
+            session.attributes['day'] = date(2017, 7, 8)
+            session.attributes_encoder = DateEncoder
+            return statement('hello')
+
+        response = app.test_client().post('/ask', data=json.dumps(launch))
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual('hello', data['response']['outputSpeech']['text'])
+        self.assertEqual('2017-07-08', data['sessionAttributes']['day'])
+
+    def test_flask_backend_uses_app_json_encoder(self):
+        app = Flask(__name__)
+        app.config['ASK_VERIFY_REQUESTS'] = False
+        app.json_encoder = DateEncoder
+        ask = Ask(app, '/ask')
+
+        @ask.launch
+        def launched():
+            session.attributes['day'] = date(2017, 7, 8)
+            return statement('hello')
+
+        response = app.test_client().post('/ask', data=json.dumps(launch))
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual('2017-07-08', data['sessionAttributes']['day'])
+
+
+if __name__ == '__main__':
+    unittest.main()
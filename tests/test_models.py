@@ -0,0 +1,143 @@
+import copy
+import json
+import pickle
+import unittest
+from datetime import datetime
+
+from flask import Flask
+from flask_ask import Ask, statement, session, request
+from flask_ask.models import _Field, RequestBody, Request, Session, Slot, AudioPlayerContext
+
+
+payload = {
+    "version": "1.0",
+    "session": {
+        "new": True,
+        "attributes": {"color": "blue"},
+        "user": {"userId": "amzn1.account.AM3B00000000000000000000000"}
+    },
+    "request": {
+        "type": "IntentRequest",
+        "requestId": "string",
+        "timestamp": "2017-07-08T07:38:00Z",
+        "intent": {
+            "name": "TestIntent",
+            "slots": {"City": {"name": "City", "value": "Paris"}}
+        }
+    }
+}
+
+
+class FieldTests(unittest.TestCase):
+
+    def test_nested_dicts_are_fields(self):
+        field = _Field(payload)
+        self.assertIsInstance(field['request'], _Field)
+        self.assertIsInstance(field.request.intent, _Field)
+        self.assertEqual('Paris', field.request.intent.slots.City.value)
+        self.assertEqual(field['request']['type'], field.request.type)
+        self.assertIsNone(field.context)
+
+    def test_wrapper_is_created_once(self):
+        field = _Field(payload)
+        self.assertIs(field.request, field['request'])
+        self.assertIs(field.get('session'), field.session)
+
+    def test_items_and_values_are_wrapped(self):
+        field = _Field(payload)
+        self.assertTrue(all(isinstance(v, _Field) for k, v in field.items() if k != 'version'))
+        self.assertTrue(all(isinstance(v, _Field) for v in field.values() if v != '1.0'))
+
+    def test_mutations_are_kept_and_payload_untouched(self):
+        field = _Field(payload)
+        field.session.attributes.color = 'red'
+        field.session.attributes['size'] = 'large'
+        self.assertEqual({'color': 'red', 'size': 'large'}, field['session']['attributes'])
+        self.assertEqual({'color': 'blue'}, payload['session']['attributes'])
+
+    def test_timestamp_attributes_are_parsed(self):
+        field = _Field(payload)
+        self.assertIsInstance(field.request.timestamp, datetime)
+        self.assertEqual('2017-07-08T07:38:00Z', field.request['timestamp'])
+
+    def test_timestamp_is_parsed_once_per_value(self):
+        field = _Field(payload)
+        self.assertIs(field.request.timestamp, field.request.timestamp)
+
+        field.request.timestamp = '2018-01-01T00:00:00Z'
+        self.assertEqual(2018, field.request.timestamp.year)
+
+    def test_serializes_like_the_payload(self):
+        field = _Field(payload)
+        field.request.intent
+        self.assertEqual(json.loads(json.dumps(payload)), json.loads(json.dumps(field)))
+
+
+    def test_copies_and_pickles(self):
+        field = _Field(payload)
+        self.assertIsInstance(field.request.timestamp, datetime)
+        field.__dict__['url'] = 'https://fakestream'  # as current_stream stores its fields
+        for copied in (copy.copy(field), copy.deepcopy(field), pickle.loads(pickle.dumps(field))):
+            self.assertIsInstance(copied, _Field)
+            self.assertEqual(payload, json.loads(json.dumps(copied)))
+            self.assertEqual('blue', copied.session.attributes.color)
+            self.assertEqual('https://fakestream', copied.url)
+            self.assertEqual(datetime(2017, 7, 8, 7, 38), copied.request.timestamp.replace(tzinfo=None))
+
+
+class TypedModelTests(unittest.TestCase):
+
+    def test_modeled_fields_are_attributes(self):
+        body = RequestBody(payload)
+        self.assertIsInstance(body.request, Request)
+        self.assertIsInstance(body.session, Session)
+        self.assertEqual('IntentRequest', body.request.type)
+        self.assertIsInstance(body.request.intent.slots.City, Slot)
+        self.assertEqual('Paris', body.request.intent.slots['City'].value)
+        self.assertEqual('amzn1.account.AM3B00000000000000000000000', body.session.user.userId)
+        self.assertEqual(datetime(2017, 7, 8, 7, 38), body.request.timestamp.replace(tzinfo=None))
+        self.assertIsNone(body.context)
+
+    def test_unmodeled_fields_fall_back_to_dict_view(self):
+        body = RequestBody(dict(payload, context={'System': {'device': {'deviceId': 'echo'}},
+                                                  'AudioPlayer': {'token': 'abc', 'playerActivity': 'PLAYING'}}))
+        self.assertEqual('echo', body.context.System.device.deviceId)
+        self.assertEqual('echo', body.context['System']['device']['deviceId'])
+        self.assertEqual('string', body.request.requestId)
+        self.assertEqual('string', body.request['requestId'])
+        self.assertIsNone(body.request.missing)
+        self.assertIsInstance(body.context.AudioPlayer, AudioPlayerContext)
+        self.assertEqual({'token': 'abc', 'playerActivity': 'PLAYING'}, dict(body.context.AudioPlayer.items()))
+
+    def test_assignments_are_visible_both_ways(self):
+        body = RequestBody(payload)
+        body.session.attributes = _Field({'count': 1})
+        body.session['dialogState'] = 'STARTED'
+        self.assertEqual({'count': 1}, body.session['attributes'])
+        self.assertEqual('STARTED', body.session.dialogState)
+        self.assertEqual({'color': 'blue'}, payload['session']['attributes'])
+
+    def test_ask_uses_typed_models_when_configured(self):
+        app = Flask(__name__)
+        app.config['ASK_VERIFY_REQUESTS'] = False
+        app.config['ASK_TYPED_MODELS'] = True
+        ask = Ask(app, '/ask')
+        seen = {}
+
+        @ask.intent('TestIntent', convert={'city': str}, mapping={'city': 'City'})
+        def test_intent(city):
+            seen['request'] = request._get_current_object()
+            seen['city'] = city
+            session.attributes['city'] = city
+            return statement('ok')
+
+        response = app.test_client().post('/ask', data=json.dumps(payload))
+        self.assertEqual(200, response.status_code)
+        self.assertIsInstance(seen['request'], Request)
+        self.assertEqual('Paris', seen['city'])
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual({'color': 'blue', 'city': 'Paris'}, data['sessionAttributes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+import fnmatch
+import socket
+import threading
+import time
+import unittest
+
+from mock import patch
+from six.moves import socketserver
+
+from flask_ask.cache import StreamUnitOfWork, push_stream, top_stream, pack_streams, unpack_streams
+from flask_ask.redis_cache import RedisStreamCache, ConnectionPool, RedisError, _Connection
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """ In-process server answering the subset of Redis commands RedisStreamCache uses """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), FakeRedisHandler)
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.commands = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _live(self, key):
+        if key in self.expires and self.expires[key] <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def _list(self, key):
+        value = self._live(key)
+        if value is not None and not isinstance(value, list):
+            raise TypeError
+        return value
+
+    def run(self, name, args):
+        self.commands.append(name)
+        handler = getattr(self, 'cmd_' + name.lower(), None)
+        if handler is None:
+            return RedisError("ERR unknown command '{}'".format(name))
+        try:
+            return handler(*args)
+        except TypeError:
+            return RedisError('WRONGTYPE Operation against a key holding the wrong kind of value')
+
+    def cmd_ping(self):
+        return b'PONG'
+
+    def cmd_get(self, key):
+        value = self._live(key)
+        if isinstance(value, list):
+            raise TypeError
+        return value
+
+    def cmd_set(self, key, value, *options):
+        options = [o.upper() for o in options]
+        if b'NX' in options and self._live(key) is not None:
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if b'PX' in options:
+            self.expires[key] = time.time() + int(options[options.index(b'PX') + 1]) / 1000.0
+        return b'OK'
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            removed += self._live(key) is not None
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_exists(self, key):
+        return int(self._live(key) is not None)
+
+    def cmd_keys(self, pattern):
+        return [k for k in list(self.data) if self._live(k) is not None and fnmatch.fnmatch(k, pattern)]
+
+    def cmd_lpush(self, key, *values):
+        stack = self._list(key)
+        if stack is None:
+            stack = self.data[key] = []
+        for value in values:
+            stack.insert(0, value)
+        return len(stack)
+
+    def cmd_lindex(self, key, index):
+        stack = self._list(key) or []
+        index = int(index)
+        return stack[index] if -len(stack) <= index < len(stack) else None
+
+    def cmd_lrange(self, key, start, stop):
+        stack = self._list(key) or []
+        stop = int(stop)
+        return stack[int(start):None if stop == -1 else stop + 1]
+
+    def cmd_ltrim(self, key, start, stop):
+        stack = self._list(key)
+        if stack is not None:
+            stop = int(stop)
+            stack[:] = stack[int(start):None if stop == -1 else stop + 1]
+        return b'OK'
+
+    def cmd_pexpire(self, key, ms):
+        if self._live(key) is None:
+            return 0
+        self.expires[key] = time.time() + int(ms) / 1000.0
+        return 1
+
+    def cmd_persist(self, key):
+        return int(self.expires.pop(key, None) is not None)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.server.connections += 1
+        queued = None
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            name = command[0].decode('ascii').upper()
+            with self.server.lock:
+                if name == 'MULTI':
+                    queued, reply = [], b'OK'
+                elif name == 'EXEC':
+                    reply = [self.server.run(n, args) for n, args in queued]
+                    queued = None
+                elif queued is not None:
+                    queued.append((name, command[1:]))
+                    reply = b'QUEUED'
+                else:
+                    reply = self.server.run(name, command[1:])
+            self.wfile.write(self.encode(reply, status=name in ('MULTI', 'SET', 'LTRIM', 'PING') or
+                                         reply == b'QUEUED'))
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def encode(self, reply, status=False):
+        if isinstance(reply, RedisError):
+            return b'-' + str(reply).encode('utf-8') + b'\r\n'
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, list):
+            return b'*%d\r\n' % len(reply) + b''.join(self.encode(r) for r in reply)
+        if status:
+            return b'+' + reply + b'\r\n'
+        return b'$%d\r\n' % len(reply) + reply + b'\r\n'
+
+
+class RedisStreamCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeRedisServer().start()
+        self.cache = RedisStreamCache(port=self.server.port)
+
+    def tearDown(self):
+        self.cache.pool.disconnect()
+        self.server.stop()
+
+    def test_basic_cache_methods(self):
+        self.assertIsNone(self.cache.get('dave'))
+        self.assertTrue(self.cache.set('dave', [{'token': 'a'}, {'token': 'b'}]))
+        self.assertEqual([{'token': 'a'}, {'token': 'b'}], self.cache.get('dave'))
+        self.assertIsInstance(self.server.data[b'flask-ask:dave'], list)
+        self.assertEqual({'token': 'b'}, top_stream(self.cache, 'dave'))
+
+        self.assertTrue(self.cache.add('request-id', True, timeout=10))
+        self.assertFalse(self.cache.add('request-id', True))
+        self.assertTrue(self.cache.get('request-id'))
+        self.assertTrue(self.cache.has('dave'))
+        self.assertTrue(self.cache.delete('dave'))
+        self.assertFalse(self.cache.delete('dave'))
+        self.cache.clear()
+        self.assertEqual({}, self.server.data)
+
+    def test_unit_of_work_is_one_pipelined_transaction(self):
+        push_stream(self.cache, 'dave', {'token': 'a'})
+        work = StreamUnitOfWork(self.cache, 'dave', max_depth=2)
+        work.push({'token': 'b'})
+        work.push({'token': 'c'})
+        with patch.object(_Connection, 'send', autospec=True, side_effect=_Connection.send) as send:
+            self.assertTrue(work.commit())
+        self.assertEqual(1, send.call_count)
+        self.assertEqual([{'token': 'b'}, {'token': 'c'}], self.cache.get('dave'))
+        self.assertIn(b'flask-ask:dave', self.server.expires)
+
+        work = StreamUnitOfWork(self.cache, 'dave')
+        work.set({'token': 'd'})
+        work.commit()
+        self.assertEqual([{'token': 'd'}], self.cache.get('dave'))
+
+    def test_unit_of_work_reads_only_the_top(self):
+        self.cache.set('dave', [{'token': str(i)} for i in range(100)])
+        del self.server.commands[:]
+        work = StreamUnitOfWork(self.cache, 'dave')
+        self.assertEqual({'token': '99'}, work.top())
+        self.assertEqual(['LINDEX'], self.server.commands)
+
+    def test_idle_connections_are_not_shared_after_fork(self):
+        self.cache.get('dave')
+        self.assertEqual(1, self.server.connections)
+        with patch('flask_ask.redis_cache.os.getpid', return_value=-1):
+            self.cache.get('dave')
+            self.cache.get('dave')
+        self.assertEqual(2, self.server.connections)
+
+    def test_packed_stacks_are_read_and_converted(self):
+        self.cache.set('dave', pack_streams([{'token': 'a'}]))
+        self.assertEqual({'token': 'a'}, top_stream(self.cache, 'dave'))
+        self.assertEqual([{'token': 'a'}], unpack_streams(self.cache.get('dave')))
+        work = StreamUnitOfWork(self.cache, 'dave')
+        work.push({'token': 'b'})
+        work.commit()
+        self.assertEqual([{'token': 'a'}, {'token': 'b'}], self.cache.get('dave'))
+
+    def test_connections_are_pooled(self):
+        threads = [threading.Thread(target=lambda: [self.cache.get('dave') for _ in range(20)]) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertLessEqual(self.server.connections, 4)
+        self.assertEqual(80, self.server.commands.count('LRANGE'))
+
+    def test_errors(self):
+        self.assertIsInstance(self.cache.pool.execute(('NOSUCHCOMMAND',))[0], RedisError)
+        # the fake server rejects AUTH, like a server without a password
+        with self.assertRaises(RedisError):
+            RedisStreamCache(port=self.server.port, password='secret').get('dave')
+
+        server = FakeRedisServer().start()
+        pool = ConnectionPool(port=server.port)
+        self.assertEqual([b'PONG'], pool.execute(('PING',)))
+        server.stop()
+        pool.disconnect()
+        with self.assertRaises((socket.error, RedisError)):
+            pool.execute(('PING',))
+
+
+if __name__ == '__main__':
+    unittest.main()
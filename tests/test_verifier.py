@@ -0,0 +1,345 @@
+import io
+import os
+import json
+import base64
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from mock import patch
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+
+from OpenSSL import crypto
+from flask import Flask
+
+from flask_ask import Ask, verifier, statement
+
+
+CERT_URL = 'https://s3.amazonaws.com/echo.api/echo-api-cert.pem'
+
+
+def make_certificate(days=30, dns_name=u'echo-api.amazon.com'):
+    """ Build a self-signed PEM chain that looks like Amazon's signing certificate. """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, dns_name)])
+    now = datetime.utcnow()
+    cert = (x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(1000)
+            .not_valid_before(now - timedelta(days=1))
+            .not_valid_after(now + timedelta(days=days))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName(dns_name)]), critical=False)
+            .sign(key, hashes.SHA256(), default_backend()))
+    return key, cert.public_bytes(serialization.Encoding.PEM)
+
+
+class FakeOpener(object):
+    """ Stand-in for urlopen that serves a fixed certificate and counts fetches. """
+
+    def __init__(self, cert_data):
+        self.cert_data = cert_data
+        self.urls = []
+        self.delay = 0
+
+    def __call__(self, url):
+        self.urls.append(url)
+        time.sleep(self.delay)
+        return io.BytesIO(self.cert_data)
+
+
+def sign(key, body):
+    return base64.b64encode(key.sign(body, padding.PKCS1v15(), hashes.SHA1()))
+
+
+class VerifiedCertificateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.key, self.cert_data = make_certificate()
+        self.body = b'{"version": "1.0"}'
+
+    def test_verifies_signature(self):
+        cert = verifier.VerifiedCertificate(self.cert_data)
+        verifier.verify_signature(cert, sign(self.key, self.body), self.body)
+        with self.assertRaises(verifier.VerificationError):
+            verifier.verify_signature(cert, sign(self.key, self.body), self.body + b' ')
+        with self.assertRaises(verifier.VerificationError):
+            verifier.verify_signature(cert, b'not base64!', self.body)
+
+    def test_x509_signature_path_still_supported(self):
+        cert = verifier.VerifiedCertificate(self.cert_data)
+        verifier.verify_signature(cert.x509, sign(self.key, self.body), self.body)
+
+    def test_rejects_wrong_san_and_expired(self):
+        with self.assertRaises(verifier.VerificationError):
+            verifier.VerifiedCertificate(make_certificate(dns_name=u'example.com')[1])
+        with self.assertRaises(verifier.VerificationError):
+            verifier.VerifiedCertificate(make_certificate(days=-1)[1])
+
+
+class CertificateCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.key, self.cert_data = make_certificate()
+        self.opener = FakeOpener(self.cert_data)
+        self.patcher = patch('flask_ask.verifier.urlopen', new=self.opener)
+        self.patcher.start()
+        self.cache = verifier.CertificateCache(max_size=2)
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_only_first_load_fetches(self):
+        first = verifier.load_certificate(CERT_URL, cache=self.cache)
+        second = verifier.load_certificate(CERT_URL, cache=self.cache)
+        self.assertIs(first, second)
+        self.assertEqual(1, len(self.opener.urls))
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_keyed_by_normalized_url(self):
+        verifier.load_certificate(CERT_URL, cache=self.cache)
+        verifier.load_certificate('https://s3.amazonaws.com:443/echo.api/../echo.api/echo-api-cert.pem',
+                                  cache=self.cache)
+        verifier.load_certificate('https://S3.amazonaws.com/echo.api/echo-api-cert.pem', cache=self.cache)
+        self.assertEqual(1, len(self.opener.urls))
+
+    def test_expired_entries_are_refetched(self):
+        cert = verifier.load_certificate(CERT_URL, cache=self.cache)
+        self.cache.set(CERT_URL, cert, datetime.utcnow() - timedelta(seconds=1))
+        verifier.load_certificate(CERT_URL, cache=self.cache)
+        self.assertEqual(2, len(self.opener.urls))
+
+    def test_evicts_least_recently_used(self):
+        urls = ['https://s3.amazonaws.com/echo.api/{}.pem'.format(i) for i in range(3)]
+        for url in urls:
+            verifier.load_certificate(url, cache=self.cache)
+        self.assertEqual(2, len(self.cache))
+        self.assertIsNone(self.cache.get(urls[0]))
+        self.assertIsNotNone(self.cache.get(urls[2]))
+
+    def test_invalid_url_is_rejected_before_cache(self):
+        verifier.load_certificate(CERT_URL, cache=self.cache)
+        with self.assertRaises(verifier.VerificationError):
+            verifier.load_certificate('http://s3.amazonaws.com/echo.api/echo-api-cert.pem', cache=self.cache)
+
+    def test_warm_up_loads_certificates(self):
+        failed = verifier.warm_up([CERT_URL, 'http://example.com/cert.pem'], self.cache)
+        self.assertEqual(['http://example.com/cert.pem'], failed)
+        self.assertEqual(1, len(self.cache))
+        self.assertEqual(1, len(self.opener.urls))
+
+    def test_invalid_certificate_is_not_cached(self):
+        self.opener.cert_data = make_certificate(dns_name=u'example.com')[1]
+        with self.assertRaises(verifier.VerificationError):
+            verifier.load_certificate(CERT_URL, cache=self.cache)
+        self.assertEqual(0, len(self.cache))
+
+
+class FileCertificateCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.opener = FakeOpener(make_certificate()[1])
+        self.patcher = patch('flask_ask.verifier.urlopen', new=self.opener)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.directory)
+
+    def test_directory_must_be_private(self):
+        created = os.path.join(self.directory, 'certs')
+        verifier.FileCertificateCache(created)
+        self.assertEqual(0, os.stat(created).st_mode & 0o077)
+
+        os.chmod(self.directory, 0o777)
+        with self.assertRaises(verifier.VerificationError):
+            verifier.FileCertificateCache(self.directory)
+        os.chmod(self.directory, 0o700)
+        with patch('flask_ask.verifier.os.getuid', return_value=os.getuid() + 1):
+            with self.assertRaises(verifier.VerificationError):
+                verifier.FileCertificateCache(self.directory)
+
+    def test_workers_share_fetched_certificate(self):
+        worker_a = verifier.FileCertificateCache(self.directory)
+        worker_b = verifier.FileCertificateCache(self.directory)
+        verifier.load_certificate(CERT_URL, cache=worker_a)
+        cert = verifier.load_certificate(CERT_URL, cache=worker_b)
+        self.assertIsInstance(cert, verifier.VerifiedCertificate)
+        self.assertIsInstance(cert.x509, crypto.X509)
+        self.assertEqual(1, len(self.opener.urls))
+
+        # once loaded from disk, the parsed certificate is served from memory
+        self.assertIs(cert, worker_b.get(CERT_URL))
+
+    def test_expired_file_is_ignored(self):
+        worker_a = verifier.FileCertificateCache(self.directory)
+        cert = verifier.load_certificate(CERT_URL, cache=worker_a)
+        worker_a.set(CERT_URL, cert, datetime.utcnow() - timedelta(seconds=1))
+        worker_b = verifier.FileCertificateCache(self.directory)
+        self.assertIsNone(worker_b.get(CERT_URL))
+
+    def test_concurrent_cold_workers_fetch_once(self):
+        self.opener.delay = 0.2
+        workers = [verifier.FileCertificateCache(self.directory) for _ in range(4)]
+        threads = [threading.Thread(target=verifier.load_certificate, args=(CERT_URL, w)) for w in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(self.opener.urls))
+        # one certificate file, no temporary files left behind
+        self.assertEqual(1, len([name for name in os.listdir(self.directory) if name.endswith('.pem')]))
+        self.assertFalse([name for name in os.listdir(self.directory) if name.startswith('.tmp-')])
+
+
+class RequestIdCacheTests(unittest.TestCase):
+
+    def test_rejects_ids_seen_within_window(self):
+        cache = verifier.RequestIdCache(window=300, bucket_seconds=10)
+        with patch('flask_ask.verifier.time.time', return_value=1000.0) as clock:
+            verifier.verify_request_id('request-1', cache)
+            with self.assertRaises(verifier.VerificationError):
+                verifier.verify_request_id('request-1', cache)
+
+            clock.return_value = 1290.0
+            with self.assertRaises(verifier.VerificationError):
+                verifier.verify_request_id('request-1', cache)
+
+            clock.return_value = 1320.0
+            verifier.verify_request_id('request-1', cache)
+
+    def test_memory_stays_bounded(self):
+        cache = verifier.RequestIdCache(window=300, bucket_seconds=10)
+        with patch('flask_ask.verifier.time.time', return_value=1000.0) as clock:
+            for i in range(1000):
+                clock.return_value = 1000.0 + i
+                cache.add('request-{}'.format(i))
+        # ring of 31 ten-second buckets holds at most 310 seconds of ids
+        self.assertLessEqual(len(cache), 310)
+
+    def test_missing_request_id_is_rejected(self):
+        with self.assertRaises(verifier.VerificationError):
+            verifier.verify_request_id(None, verifier.RequestIdCache())
+
+
+class CertificateRefresherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.opener = FakeOpener(make_certificate(days=30)[1])
+        self.patcher = patch('flask_ask.verifier.urlopen', new=self.opener)
+        self.patcher.start()
+        self.cache = verifier.CertificateCache()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_refreshes_missing_and_expiring_certificates(self):
+        refresher = verifier.CertificateRefresher(self.cache, lead_time=3600)
+        refresher.track(CERT_URL)
+        refresher.refresh()
+        self.assertEqual(1, len(self.opener.urls))
+        self.assertIsNotNone(self.cache.expires(CERT_URL))
+
+        # not close to expiry yet
+        refresher.refresh()
+        self.assertEqual(1, len(self.opener.urls))
+
+        refresher.lead_time = 60 * 60 * 24 * 31
+        refresher.refresh()
+        self.assertEqual(2, len(self.opener.urls))
+
+    def test_failed_refresh_keeps_thread_alive(self):
+        refresher = verifier.CertificateRefresher(self.cache)
+        refresher.track('https://example.com/echo.api/cert.pem')
+        refresher.refresh()
+        self.assertEqual([], self.opener.urls)
+
+    def test_restarts_thread_after_fork(self):
+        refresher = verifier.CertificateRefresher(self.cache, interval=3600)
+        refresher.start()
+        inherited = refresher._thread
+        try:
+            refresher.track(CERT_URL)
+            self.assertIs(inherited, refresher._thread)
+            with patch('flask_ask.verifier.os.getpid', return_value=-1):
+                refresher.track(CERT_URL)
+                self.assertIsNot(inherited, refresher._thread)
+                self.assertTrue(refresher._thread.is_alive())
+                refresher.start()
+                refresher.stop()
+        finally:
+            refresher._stopped.set()
+            inherited.join()
+
+    def test_init_app_preseeds_configured_urls(self):
+        app = Flask(__name__)
+        app.config['ASK_CERT_REFRESH_AHEAD'] = 3600
+        app.config['ASK_CERT_URLS'] = [CERT_URL]
+        ask = Ask(app, '/ask', cert_cache=self.cache)
+        try:
+            for _ in range(100):
+                if self.cache.expires(CERT_URL) is not None:
+                    break
+                time.sleep(0.01)
+            self.assertIsNotNone(self.cache.expires(CERT_URL))
+        finally:
+            ask.cert_refresher.stop()
+
+
+class SignedRequestTests(unittest.TestCase):
+    """ Full requests through the view function, with real signatures. """
+
+    def setUp(self):
+        self.key, cert_data = make_certificate()
+        self.patcher = patch('flask_ask.verifier.urlopen', new=FakeOpener(cert_data))
+        self.patcher.start()
+        self.app = Flask(__name__)
+        self.ask = Ask(self.app, '/ask')
+        self.client = self.app.test_client()
+        self.launched = []
+
+        @self.ask.launch
+        def launch():
+            self.launched.append(True)
+            return statement('hello')
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def post(self, body, signature):
+        return self.client.post('/ask', data=body, headers={'Signaturecertchainurl': CERT_URL,
+                                                            'Signature': signature})
+
+    def body(self):
+        return json.dumps({
+            'version': '1.0',
+            'session': {'new': False, 'application': {'applicationId': 'app'}, 'user': {'userId': 'dave'}},
+            'request': {'type': 'LaunchRequest', 'requestId': 'request-1',
+                        'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')}
+        }).encode('utf-8')
+
+    def test_accepts_valid_signature(self):
+        body = self.body()
+        response = self.post(body, sign(self.key, body))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([True], self.launched)
+
+    def test_rejects_bad_signature_before_view(self):
+        body = self.body()
+        response = self.post(body, sign(self.key, body + b' '))
+        self.assertEqual(500, response.status_code)
+        self.assertEqual([], self.launched)
+
+
+if __name__ == '__main__':
+    unittest.main()